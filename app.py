@@ -1,10 +1,36 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for, flash, session, abort
+from flask import Flask, render_template, get_template_attribute, jsonify, request, redirect, url_for, flash, session, abort, Response, stream_with_context, g, has_request_context, before_render_template, template_rendered
+import contextlib
+import csv
+import functools
+import itertools
+import io
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from flask_admin import Admin, AdminIndexView, expose
+from flask_admin.actions import action
 from flask_admin.contrib.sqla import ModelView
 from flask_admin.contrib.sqla.ajax import QueryAjaxModelLoader
-from sqlalchemy import CheckConstraint
+from sqlalchemy import CheckConstraint, UniqueConstraint, Index, Select, bindparam, create_engine, event, make_url, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import validates, make_transient_to_detached
+from sqlalchemy.orm.base import NO_VALUE
+from sqlalchemy.exc import IntegrityError, OperationalError
 from werkzeug.security import generate_password_hash, check_password_hash
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import click
+from flask.cli import AppGroup
 
 from flask_login import UserMixin, LoginManager, current_user, login_user, logout_user, login_required
 
@@ -15,7 +41,127 @@ app = Flask(__name__)
 
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///example.sqlite"
 app.config["SECRET_KEY"] = "mysecret"
-db = SQLAlchemy(app)
+app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:600000" # any werkzeug method, e.g. "scrypt:32768:8:1"
+app.config["PASSWORD_HASH_WORKERS"] = os.cpu_count() or 1  # hashing processes, 0 hashes on the request thread
+app.config["PASSWORD_HASH_QUEUE"] = 32                     # jobs allowed to wait for a worker before we answer 503
+app.config["IDENTITY_CACHE_TTL"] = 0 # seconds, 0 turns the process-local identity cache off
+app.config["DB_PROFILE"] = "default"
+app.config["DB_POOL_SIZE"] = 10     # connections kept per process, roughly one per worker thread
+app.config["DB_MAX_OVERFLOW"] = 20
+app.config["DB_POOL_RECYCLE"] = 1800 # seconds, only used for server databases
+app.config["REPLICA_DATABASE_URL"] = None # read-only views use this engine when set
+app.config["REPLICA_STICKY_SECONDS"] = 5  # after a write, that browser reads from the primary for this long
+app.config["FRAGMENT_CACHE_SIZE"] = 1024  # rendered fragments kept in the in-process LRU
+app.config["FRAGMENT_CACHE_TTL"] = 300    # seconds, a safety net: commits invalidate entries straight away
+app.config["FRAGMENT_CACHE_REDIS_URL"] = None # share fragments between processes through redis instead
+app.config["SEAT_STREAM_INTERVAL"] = 1.0   # seconds, seat changes inside this window go out as one event
+app.config["SEAT_STREAM_KEEPALIVE"] = 15.0 # seconds between keepalive comments on a quiet stream
+app.config["SEAT_STREAM_MAX"] = 1000       # open seat streams per process
+app.config["LOG_LEVEL"] = "WARNING"  # INFO adds one structured line per request, DEBUG the login/logout traces
+app.config["METRICS_ENABLED"] = True # per-request SQL/template timing and the /metrics endpoint
+app.config["METRICS_PUBLIC"] = False # True serves /metrics to anyone (a Prometheus scraper), otherwise admins only
+app.config["SLOW_QUERY_MS"] = 0      # log the SQLite query plan of statements slower than this, 0 is off
+app.config["ADMIN_COUNT_CACHE_TTL"] = 60 # seconds an admin list reuses its row count, 0 counts on every page
+app.config["ADMIN_AJAX_LIMIT"] = 20      # most rows a type-ahead picker in the admin forms returns
+app.config["ADMIN_BULK_CHUNK"] = 500     # rows per statement (and per commit) in the admin bulk actions
+app.config["TERM_CACHE_TTL"] = 60        # seconds a process reuses the active term, term edits here refresh it at once
+app.config["ARCHIVE_DATABASE"] = None    # SQLite file archive-terms moves closed terms to, default archive.sqlite beside the database
+
+# Overrides: a python settings file named by APP_SETTINGS, then APP_* environment variables
+# (APP_DB_PROFILE=production, APP_DB_POOL_SIZE=32, ...), then DATABASE_URL for the database itself,
+# so the same code can point at another SQLite file or a server database.
+app.config.from_envvar("APP_SETTINGS", silent=True)
+app.config.from_prefixed_env("APP")
+if os.environ.get("DATABASE_URL"):
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ["DATABASE_URL"]
+
+
+# SQLite pragmas applied to every new connection for each database profile
+DB_PROFILES = {
+    # stock SQLite: rollback journal, so readers wait behind every enrollment or grade write
+    "default": {
+        "busy_timeout": 5000,
+    },
+    # WAL lets readers carry on while the one writer commits; synchronous=NORMAL is safe under WAL
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,     # KiB, so 64 MB of page cache per connection
+        "mmap_size": 268435456,   # 256 MB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,     # ms to wait for the write lock before "database is locked"
+    },
+}
+
+
+def engine_options(url, config):
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    options = {"pool_size": config["DB_POOL_SIZE"], "max_overflow": config["DB_MAX_OVERFLOW"]}
+    if url.get_backend_name() != "sqlite":
+        options.update(pool_pre_ping=True, pool_recycle=config["DB_POOL_RECYCLE"])
+    return options
+
+
+def apply_pragmas(dbapi_connection, profile, read_only=False):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return # server databases are tuned on the server
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys = ON") # ON DELETE CASCADE / SET NULL only run when this is on
+    for name, value in DB_PROFILES[profile].items():
+        if read_only and name in ("journal_mode", "synchronous"):
+            continue # set by the primary, a mode=ro connection cannot change them
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+# Read/write routing: views marked @read_only send their SELECTs to the replica engine. Flushes,
+# INSERT/UPDATE/DELETE and every other view stay on the primary, and a browser that just wrote
+# keeps reading from the primary for REPLICA_STICKY_SECONDS so it sees its own changes.
+replica_engine = None
+
+class RoutingSession(FlaskSession):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and isinstance(clause, Select):
+            if replica_engine is not None and reading_from_replica():
+                return replica_engine
+        elif has_request_context():
+            g.db_wrote = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def reading_from_replica():
+    return has_request_context() and g.get('read_only', False) and session.get('primary_until', 0) < time.time()
+
+
+@contextlib.contextmanager
+def reading_from_primary():
+    # for cache fills inside @read_only views: a replica that lags the invalidating commit would put
+    # the old rows straight back into a cache every browser shares
+    if not has_request_context():
+        yield
+        return
+    was_read_only, g.read_only = g.get('read_only', False), False
+    try:
+        yield
+    finally:
+        g.read_only = was_read_only
+
+
+def read_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.read_only = False
+    return wrapper
+
+
+app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config["SQLALCHEMY_DATABASE_URI"], app.config))
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
 
 
 login_manager = LoginManager()
@@ -23,26 +169,234 @@ login_manager.init_app(app)
 login_manager.login_view = 'login' #routes to this when unauthenticated
 
 
+# Identity loading: one primary-key lookup on the table for the session's role. Flask-Login keeps
+# the result as current_user for the rest of the request, so views use it instead of querying again.
+# IDENTITY_CACHE_TTL > 0 also keeps a short-lived copy per process so most page views skip the
+# query entirely; the admin views drop entries when they edit a user.
+
+_identity_cache = {} # (role, id) -> (expires, model, column values)
+_identity_cache_lock = threading.Lock()
+
+def identity_model(role):
+    return {'admin': AdminLogin, 'teacher': Teacher}.get(role, User)
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    check = session.get('admin', None)
-    check2 = session.get('teacher', None)
-    if check == True:
-        return AdminLogin.query.get(int(user_id))
-    elif check2 == True:
-        return Teacher.query.get(int(user_id))
-    else:
-        return User.query.get(int(user_id))
+    role = session.get('role') or 'student'
+    key = (role, int(user_id))
+
+    user = cached_identity(key)
+    if user is None:
+        user = db.session.get(identity_model(role), key[1])
+        if user is not None and app.config["IDENTITY_CACHE_TTL"]:
+            remember_identity(key, user)
+    return user
+
+
+def cached_identity(key):
+    with _identity_cache_lock:
+        entry = _identity_cache.get(key)
+    if entry is None or entry[0] < time.monotonic():
+        return None
+    # rebuild the row as a persistent object without going back to the database
+    user = entry[1](**entry[2])
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def remember_identity(key, user):
+    values = {attr.key: getattr(user, attr.key) for attr in db.inspect(type(user)).column_attrs}
+    with _identity_cache_lock:
+        _identity_cache[key] = (time.monotonic() + app.config["IDENTITY_CACHE_TTL"], type(user), values)
+
+
+def forget_identity(user):
+    forget_identities({AdminLogin: 'admin', Teacher: 'teacher'}.get(type(user), 'student'), [user.id])
+
+
+def forget_identities(role, ids):
+    with _identity_cache_lock:
+        for id in ids:
+            _identity_cache.pop((role, id), None)
+
+
+# No app context is pushed for the whole module: a request would reuse it, and with it g and the
+# logged in user of whichever request ran before on that thread. Scripts use `with app.app_context()`,
+# `flask shell` and the CLI commands push their own.
+with app.app_context():
+    for engine in db.engines.values():
+        event.listen(engine, "connect", lambda connection, record: apply_pragmas(connection, app.config["DB_PROFILE"]))
+
+    # Replica: REPLICA_DATABASE_URL, or under the WAL profile a second read-only connection to the same file
+    if not app.config["REPLICA_DATABASE_URL"] and app.config["DB_PROFILE"] == "production" \
+            and db.engine.url.get_backend_name() == "sqlite" and db.engine.url.database not in (None, "", ":memory:"):
+        app.config["REPLICA_DATABASE_URL"] = f"sqlite:///file:{db.engine.url.database}?mode=ro&uri=true"
+
+if app.config["REPLICA_DATABASE_URL"]:
+    replica_engine = create_engine(app.config["REPLICA_DATABASE_URL"],
+                                   **engine_options(app.config["REPLICA_DATABASE_URL"], app.config))
+    event.listen(replica_engine, "connect",
+                 lambda connection, record: apply_pragmas(connection, app.config["DB_PROFILE"], read_only=True))
 
 
-app.app_context().push() # without this, I recieve flask error
+@app.after_request
+def stick_to_primary(response):
+    if g.pop('db_wrote', False):
+        session['primary_until'] = time.time() + app.config["REPLICA_STICKY_SECONDS"]
+    return response
+
+
+#  ------------------------------------------------------------------------------------------  #
+# Instrumentation: every request counts its SQL statements and the time spent in them (cursor events
+# on all engines) and in templates, then records them in per-route histograms served as Prometheus
+# text from /metrics. /metrics carries the fragment cache counters too, so like /cache_stats it is for
+# admins unless METRICS_PUBLIC opts in to serving it without a login, e.g. behind a scraper-only network.
+# With LOG_LEVEL=INFO each request also logs one JSON line on "app.requests".
+# Streaming responses (exports, /seats/stream) are measured until their headers go out.
+app.logger.setLevel(app.config["LOG_LEVEL"])
+request_log = logging.getLogger("app.requests")
+sql_log = logging.getLogger("app.sql")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name, self.help, self.buckets = name, help, buckets
+        self.series = {} # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.series.setdefault(labels, [0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, series in sorted(self.series.items()):
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series[-1]}')
+                lines.append(f"{self.name}_sum{{{label_text}}} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{{{label_text}}} {series[-1]}")
+        return lines
+
+
+request_seconds = Histogram("app_request_duration_seconds", "Time to produce the response.", LATENCY_BUCKETS)
+request_sql_seconds = Histogram("app_request_sql_seconds", "Time spent in SQL per request.", LATENCY_BUCKETS)
+request_template_seconds = Histogram("app_request_template_seconds", "Time spent rendering templates per request.", LATENCY_BUCKETS)
+request_statements = Histogram("app_request_sql_statements", "SQL statements executed per request.", STATEMENT_BUCKETS)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def sql_started(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def sql_finished(connection, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - connection.info["query_started"].pop()
+    if has_request_context() and "request_started" in g:
+        g.sql_count += 1
+        g.sql_seconds += elapsed
+    slow_ms = app.config["SLOW_QUERY_MS"]
+    if slow_ms and elapsed * 1000 >= slow_ms and sql_log.isEnabledFor(logging.WARNING):
+        sql_log.warning("slow query %.1f ms: %s\n%s", elapsed * 1000, statement,
+                        explain_plan(connection, statement, parameters, executemany))
+
+
+@event.listens_for(Engine, "handle_error")
+def sql_failed(exception_context):
+    # a statement that raised never reaches after_cursor_execute, so drop its start time here
+    connection = exception_context.connection
+    if connection is not None and exception_context.execution_context is not None:
+        started = connection.info.get("query_started")
+        if started:
+            started.pop()
+
+
+def explain_plan(connection, statement, parameters, executemany):
+    dbapi_connection = connection.connection.dbapi_connection
+    if executemany or not isinstance(dbapi_connection, sqlite3.Connection):
+        return "  (no plan: executemany or not SQLite)"
+    if statement.lstrip().split(None, 1)[0].upper() not in ("SELECT", "WITH", "UPDATE", "DELETE"):
+        return "  (no plan for this statement)"
+    cursor = dbapi_connection.cursor() # a raw cursor, so the EXPLAIN is not timed or explained itself
+    try:
+        plan = cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    except sqlite3.Error as error:
+        return f"  (no plan: {error})"
+    finally:
+        cursor.close()
+    return "\n".join(f"  {detail}" for _id, _parent, _unused, detail in plan)
+
+
+@before_render_template.connect_via(app)
+def template_started(sender, template, context, **extra):
+    g.setdefault("template_started", []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def template_finished(sender, template, context, **extra):
+    started = g.template_started.pop()
+    if not g.template_started and "request_started" in g: # nested renders are part of the outer one
+        g.template_seconds += time.perf_counter() - started
+
+
+if app.config["METRICS_ENABLED"]:
+    @app.before_request
+    def start_request_metrics():
+        g.request_started = time.perf_counter()
+        g.sql_count, g.sql_seconds, g.template_seconds = 0, 0.0, 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if "request_started" not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        route = request.url_rule.rule if request.url_rule else "unmatched" # keeps label cardinality bounded
+        labels = (("method", request.method), ("route", route))
+        request_seconds.observe(labels + (("status", str(response.status_code)),), elapsed)
+        request_sql_seconds.observe(labels, g.sql_seconds)
+        request_template_seconds.observe(labels, g.template_seconds)
+        request_statements.observe(labels, g.sql_count)
+        if request_log.isEnabledFor(logging.INFO):
+            request_log.info(json.dumps({
+                "method": request.method, "path": request.path, "route": route, "status": response.status_code,
+                "ms": round(elapsed * 1000, 2), "sql": g.sql_count, "sql_ms": round(g.sql_seconds * 1000, 2),
+                "template_ms": round(g.template_seconds * 1000, 2),
+            }))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        if not app.config["METRICS_PUBLIC"]:
+            if not current_user.is_authenticated:
+                return login_manager.unauthorized()
+            if session.get('role') != 'admin' or current_user.role != 'admin':
+                abort(403)
+        lines = []
+        for histogram in (request_seconds, request_sql_seconds, request_template_seconds, request_statements):
+            lines += histogram.exposition()
+        stats = fragment_cache.stats()
+        for name in ("hits", "misses", "evictions"):
+            lines += [f"# TYPE app_fragment_cache_{name}_total counter", f"app_fragment_cache_{name}_total {stats[name]}"]
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
 
 
 #  ------------------------------------------------------------------------------------------  #
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
-    studentName = db.Column(db.String(30), nullable=False)
+    studentName = db.Column(db.String(30), nullable=False, index=True) # admin search and sorting
     email = db.Column(db.String(30), unique=True, nullable=False)
     password = db.Column(db.String(128), nullable=False)
 
@@ -72,7 +426,7 @@ class Teacher(db.Model, UserMixin):
     password = db.Column(db.String(128), nullable=False)
 
     role = db.Column(db.String(20), default='teacher')
-    courses = db.relationship("Course", back_populates="teacher")
+    courses = db.relationship("Course", back_populates="teacher", passive_deletes=True)
 
     def __repr__(self):
         return f"T: {self.teacherName} "
@@ -100,18 +454,33 @@ class AdminLogin(db.Model, UserMixin):
         return str(self.id)
 
 
+# Academic terms. Every course belongs to one; the catalog, dashboards and conflict checks only look
+# at the active term, and `flask archive-terms` moves closed terms out to the archive database.
+class Term(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20), unique=True, nullable=False) # "Fall 2024"
+    active = db.Column(db.Boolean, nullable=False, default=False, server_default='0') # the term the site shows
+    closed = db.Column(db.Boolean, nullable=False, default=False, server_default='0') # grades are final, ready to archive
+    archived = db.Column(db.Boolean, nullable=False, default=False, server_default='0') # its courses live in the archive now
+
+    def __repr__(self):
+        return f"Term: '{self.name}'"
+
+
 class Enrollment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
-    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    student = db.relationship('User', backref=db.backref('enrollments', lazy=True))
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    student = db.relationship('User', backref=db.backref('enrollments', lazy=True, passive_deletes=True))
     
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
-    course = db.relationship('Course', backref=db.backref('enrollments', lazy=True))
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id', ondelete='CASCADE'), nullable=False)
+    course = db.relationship('Course', backref=db.backref('enrollments', lazy=True, passive_deletes=True))
     
     grade = db.Column(db.Float, nullable=False, default=100.0)
     __table_args__ = (
         CheckConstraint('grade >= 0.0 AND grade <= 100.0', name='grade_range_check'),
+        UniqueConstraint('student_id', 'course_id', name='unique_enrollment'), # replaces the "already enrolled" pre-check
+        Index('ix_enrollment_course_grade', 'course_id', 'grade', 'student_id'), # covers rosters and MIN/MAX grade per course
     )
 
 
@@ -121,22 +490,1089 @@ class Course(db.Model):
     courseName = db.Column(db.String(20), nullable=False)
     time = db.Column(db.String(20), nullable=False)
     capacity = db.Column(db.Integer, nullable = False)
+    enrolled_count = db.Column(db.Integer, nullable=False, default=0, server_default='0') # seats taken, kept in step with Enrollment
+    days_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0') # meeting days parsed from time, bit 0 = Monday
+    start_min = db.Column(db.Integer) # meeting start/end in minutes after midnight, NULL when time has no hours
+    end_min = db.Column(db.Integer)
 
-    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'), nullable=False)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id', ondelete='SET NULL')) # NULL once the teacher is deleted
     teacher = db.relationship("Teacher", back_populates="courses" )
 
+    term_id = db.Column(db.Integer, db.ForeignKey('term.id'), # new courses (imports too) go into the active term
+                        default=lambda context: active_term_id(context.connection))
+    term = db.relationship("Term")
+
+    __table_args__ = (
+        Index('ix_course_name_id', 'term_id', 'courseName', 'id'), # a term's catalog: keyset pagination + prefix search
+        Index('ix_course_teacher_id', 'teacher_id', 'term_id'),
+        Index('ix_course_meeting', 'term_id', 'start_min', 'end_min', 'days_mask'), # time-conflict lookups within a term
+    )
+
     def __repr__(self): # how database User is printed out
         return f"Course: '{self.courseName}'"
 
+    @validates('time')
+    def parse_time(self, key, value):
+        self.days_mask, self.start_min, self.end_min = parse_meeting_time(value)
+        return value
+
+
+# Admin search matches the start of these columns with LIKE, and SQLite only uses an index for
+# that when the index compares without case, the way LIKE does
+Index('ix_user_name_nocase', User.studentName.collate('NOCASE'))
+Index('ix_user_email_nocase', User.email.collate('NOCASE'))
+Index('ix_course_name_nocase', Course.courseName.collate('NOCASE'))
+Index('ix_teacher_name_nocase', Teacher.teacherName.collate('NOCASE'))
+Index('ix_teacher_email_nocase', Teacher.email.collate('NOCASE'))
+
+
+# Students waiting for a seat in a full course, promoted in position order as seats free up
+class Waitlist(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id', ondelete='CASCADE'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    position = db.Column(db.Integer, nullable=False) # grows per course, lowest goes first
+
+    __table_args__ = (
+        UniqueConstraint('course_id', 'student_id', name='unique_waitlist'),
+        UniqueConstraint('course_id', 'position', name='unique_waitlist_position'), # next in line is one index seek
+    )
+
+
+# Running grade totals per course, kept up to date as enrollments change so dashboards never
+# have to read every enrollment. Averages, spread and medians are worked out from these.
+class CourseGradeStats(db.Model):
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id', ondelete='CASCADE'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    total_sq = db.Column(db.Float, nullable=False, default=0.0) # sum of squared grades, for the std deviation
+    min_grade = db.Column(db.Float)
+    max_grade = db.Column(db.Float)
+
+
+# Histogram of grades per course in 10 point buckets (bucket 9 is 90-100)
+class CourseGradeBucket(db.Model):
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id', ondelete='CASCADE'), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Meeting days are read positionally from "MTWTF", so the second T is Thursday.
+# "Th" and "R" are also accepted for Thursday, "S" is Saturday and "U" is Sunday.
+DAY_LETTERS = 'MTWTFSU'
+
+def parse_days(days):
+    mask, slot, i = 0, 0, 0
+    while i < len(days):
+        letter = days[i].upper()
+        if days[i:i + 2].lower() == 'th':
+            letter, i = 'R', i + 1
+        if letter == 'R':
+            slot = 3
+        elif letter in DAY_LETTERS[slot:]:
+            slot = DAY_LETTERS.index(letter, slot)
+        elif letter.isdigit():
+            break # no day letters, just a time
+        else:
+            raise ValueError(f"Unrecognised meeting days: {days}")
+        mask |= 1 << slot
+        slot += 1
+        i += 1
+    return mask
+
+
+# "9:00-9:50 AM": the AM/PM on the end time also applies to the start unless that would put
+# the start after the end, so "11:00-12:15 PM" starts at 11 AM.
+HOURS_PATTERN = re.compile(r'(\d{1,2}):(\d{2})\s*([AP]M)?\s*-\s*(\d{1,2}):(\d{2})\s*([AP]M)?', re.IGNORECASE)
+
+def to_minutes(hour, minute, suffix):
+    hour, minute = int(hour), int(minute)
+    if suffix:
+        hour = hour % 12 + (12 if suffix.upper() == 'PM' else 0)
+    return hour * 60 + minute
+
+
+def parse_meeting_time(text):
+    # returns (days_mask, start_min, end_min)
+    words = text.split()
+    days = words[0] if words and words[0][0].isalpha() else ''
+    match = HOURS_PATTERN.search(text)
+    if match is None:
+        return 0, None, None # "TBA" and friends never conflict
+
+    start_h, start_m, start_suffix, end_h, end_m, end_suffix = match.groups()
+    end = to_minutes(end_h, end_m, end_suffix)
+    start = to_minutes(start_h, start_m, start_suffix or end_suffix)
+    if start_suffix is None and start > end:
+        start -= 12 * 60
+    if start >= end:
+        raise ValueError(f"Meeting time ends before it starts: {text}")
+    return parse_days(days), start, end
+
+
+#  ------------------------------------------------------------------------------------------  #
+# Terms: each process keeps the active term's id for TERM_CACHE_TTL seconds, and a commit that
+# touches a Term refreshes it straight away. Student and teacher pages take ?term=<id> to show
+# another term than the active one.
+
+_active_term = (None, 0.0) # (term id, expires)
+
+def active_term_id(connection=None):
+    global _active_term
+    term_id, expires = _active_term
+    if expires < time.monotonic():
+        term_id = (connection or db.session).execute(
+            db.select(Term.id).where(Term.active).order_by(Term.id.desc()).limit(1)
+        ).scalar()
+        _active_term = (term_id, time.monotonic() + app.config["TERM_CACHE_TTL"])
+    return term_id
+
+
+def forget_active_term():
+    global _active_term
+    _active_term = (None, 0.0)
+
+
+def requested_term_id():
+    return request.args.get('term', type=int) or active_term_id()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def collect_term_changes(session, flush_context):
+    if any(isinstance(obj, Term) for obj in itertools.chain(session.new, session.dirty, session.deleted)):
+        session.info['terms_changed'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def refresh_active_term(session):
+    if session.info.pop('terms_changed', False):
+        forget_active_term()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def keep_active_term(session):
+    session.info.pop('terms_changed', None)
+
+
 #  ------------------------------------------------------------------------------------------  #
+# Enrollment engine: Course.enrolled_count is the seat counter. Every Enrollment insert claims a
+# seat with one conditional UPDATE, and every delete gives it back, so admin edits stay in step too.
+
+class CourseFullError(Exception):
+    pass
+
+
+def claim_seat(connection, course_id):
+    result = connection.execute(
+        Course.__table__.update()
+        .where(Course.id == course_id, Course.enrolled_count < Course.capacity)
+        .values(enrolled_count=Course.enrolled_count + 1)
+    )
+    if result.rowcount == 0:
+        raise CourseFullError(course_id)
+
+
+def release_seat(connection, course_id):
+    connection.execute(
+        Course.__table__.update()
+        .where(Course.id == course_id, Course.enrolled_count > 0)
+        .values(enrolled_count=Course.enrolled_count - 1)
+    )
+
+
+@event.listens_for(Enrollment, 'after_insert')
+def enrollment_inserted(mapper, connection, enrollment):
+    # runs after the INSERT so a duplicate hits unique_enrollment before we look at seats
+    claim_seat(connection, enrollment.course_id)
+
+
+@event.listens_for(Enrollment, 'after_update')
+def enrollment_moved(mapper, connection, enrollment):
+    history = db.inspect(enrollment).attrs.course_id.history
+    if history.deleted and history.added:
+        release_seat(connection, history.deleted[0])
+        claim_seat(connection, history.added[0])
+
+
+@event.listens_for(Enrollment, 'after_delete')
+def enrollment_deleted(mapper, connection, enrollment):
+    release_seat(connection, enrollment.course_id)
+
+
+#  ------------------------------------------------------------------------------------------  #
+# Grade statistics: every change to enrollments is applied to CourseGradeStats/CourseGradeBucket
+# as deltas (count, sum, sum of squares, bucket counts), with min/max re-read through
+# ix_enrollment_course_grade. A batch of changes costs the same few statements for any number of courses.
+GRADE_BUCKETS = 10
+
+def grade_bucket(grade):
+    return min(int(grade // 10), GRADE_BUCKETS - 1)
+
+
+def apply_grade_changes(connection, changes):
+    # changes: {course_id: (removed grades, added grades)}
+    changes = {course_id: change for course_id, change in changes.items() if change[0] or change[1]}
+    if not changes:
+        return
+    stats, buckets, enrollment = CourseGradeStats.__table__, CourseGradeBucket.__table__, Enrollment.__table__
+
+    missing = db.select(bindparam('b_course'), db.literal(0), db.literal(0.0), db.literal(0.0)).where(
+        ~db.select(stats.c.course_id).where(stats.c.course_id == bindparam('b_course')).exists())
+    connection.execute(stats.insert().from_select(['course_id', 'count', 'total', 'total_sq'], missing),
+                       [{"b_course": course_id} for course_id in changes])
+
+    grades = db.select(enrollment.c.grade).where(enrollment.c.course_id == stats.c.course_id)
+    connection.execute(
+        stats.update().where(stats.c.course_id == bindparam('b_course')).values(
+            count=stats.c.count + bindparam('b_count'),
+            total=stats.c.total + bindparam('b_total'),
+            total_sq=stats.c.total_sq + bindparam('b_total_sq'),
+            min_grade=grades.order_by(enrollment.c.grade).limit(1).scalar_subquery(),
+            max_grade=grades.order_by(enrollment.c.grade.desc()).limit(1).scalar_subquery(),
+        ),
+        [{"b_course": course_id,
+          "b_count": len(added) - len(removed),
+          "b_total": sum(added) - sum(removed),
+          "b_total_sq": sum(grade * grade for grade in added) - sum(grade * grade for grade in removed)}
+         for course_id, (removed, added) in changes.items()],
+    )
+
+    deltas = []
+    for course_id, (removed, added) in changes.items():
+        counts = Counter(map(grade_bucket, added))
+        counts.subtract(map(grade_bucket, removed))
+        deltas += [{"b_course": course_id, "b_bucket": bucket, "b_delta": delta} for bucket, delta in counts.items() if delta]
+    if deltas:
+        missing = db.select(bindparam('b_course'), bindparam('b_bucket'), db.literal(0)).where(
+            ~db.select(buckets.c.course_id).where(buckets.c.course_id == bindparam('b_course'),
+                                                  buckets.c.bucket == bindparam('b_bucket')).exists())
+        connection.execute(buckets.insert().from_select(['course_id', 'bucket', 'count'], missing),
+                           [{"b_course": delta["b_course"], "b_bucket": delta["b_bucket"]} for delta in deltas])
+        connection.execute(
+            buckets.update()
+            .where(buckets.c.course_id == bindparam('b_course'), buckets.c.bucket == bindparam('b_bucket'))
+            .values(count=buckets.c.count + bindparam('b_delta')),
+            deltas,
+        )
+
+
+def refresh_grade_stats(connection, course_ids=None):
+    # repair job: rebuild the summaries (of every course when None) from the enrollment table
+    stats, buckets, enrollment = CourseGradeStats.__table__, CourseGradeBucket.__table__, Enrollment.__table__
+    grades = db.select(enrollment.c.course_id)
+    delete_stats, delete_buckets = stats.delete(), buckets.delete()
+    if course_ids is not None:
+        grades = grades.where(enrollment.c.course_id.in_(course_ids))
+        delete_stats = delete_stats.where(stats.c.course_id.in_(course_ids))
+        delete_buckets = delete_buckets.where(buckets.c.course_id.in_(course_ids))
+    connection.execute(delete_stats)
+    connection.execute(delete_buckets)
+
+    connection.execute(stats.insert().from_select(
+        ['course_id', 'count', 'total', 'total_sq', 'min_grade', 'max_grade'],
+        grades.add_columns(db.func.count(), db.func.sum(enrollment.c.grade),
+                           db.func.sum(enrollment.c.grade * enrollment.c.grade),
+                           db.func.min(enrollment.c.grade), db.func.max(enrollment.c.grade))
+        .group_by(enrollment.c.course_id)))
+    bucket = db.case((enrollment.c.grade >= (GRADE_BUCKETS - 1) * 10, GRADE_BUCKETS - 1),
+                     else_=db.cast(enrollment.c.grade / 10, db.Integer))
+    connection.execute(buckets.insert().from_select(
+        ['course_id', 'bucket', 'count'],
+        grades.add_columns(bucket, db.func.count()).group_by(enrollment.c.course_id, bucket)))
+
+
+def loaded_grade(enrollment):
+    grade = db.inspect(enrollment).attrs.grade.loaded_value
+    return None if grade is NO_VALUE else grade
+
+
+@event.listens_for(Enrollment, 'after_insert')
+def grade_added(mapper, connection, enrollment):
+    apply_grade_changes(connection, {enrollment.course_id: ((), (enrollment.grade,))})
+
+
+@event.listens_for(Enrollment, 'after_update')
+def grade_changed(mapper, connection, enrollment):
+    state = db.inspect(enrollment)
+    course, grade = state.attrs.course_id.history, state.attrs.grade.history
+    if not (course.has_changes() or grade.has_changes()):
+        return
+    old_course = course.deleted[0] if course.deleted else enrollment.course_id
+    old_grade = grade.deleted[0] if grade.deleted else enrollment.grade
+    if old_course == enrollment.course_id:
+        changes = {old_course: ((float(old_grade),), (float(enrollment.grade),))}
+    else:
+        changes = {old_course: ((float(old_grade),), ()), enrollment.course_id: ((), (float(enrollment.grade),))}
+    apply_grade_changes(connection, changes)
+
+
+@event.listens_for(Enrollment, 'after_delete')
+def grade_removed(mapper, connection, enrollment):
+    grade = loaded_grade(enrollment)
+    if grade is None:
+        refresh_grade_stats(connection, [enrollment.course_id]) # never loaded, so start that course over
+    else:
+        apply_grade_changes(connection, {enrollment.course_id: ((grade,), ())})
+
+
+def recount_seats():
+    # repair job: rebuild every counter from the Enrollment table in one statement
+    count_seats(db.session.connection())
+    stale_course_fragments(db.session)
+    db.session.commit()
+
+
+def count_seats(connection, course_ids=None):
+    enrolled = (
+        db.select(db.func.count(Enrollment.id))
+        .where(Enrollment.course_id == Course.id)
+        .scalar_subquery()
+    )
+    update = Course.__table__.update().values(enrolled_count=enrolled)
+    if course_ids is not None:
+        update = update.where(Course.__table__.c.id.in_(course_ids))
+    connection.execute(update)
+
+
+def repair_courses(course_ids):
+    # enrollments removed by ON DELETE CASCADE or bulk DELETEs skip the ORM events: recount those
+    # courses, rebuild their grade stats, refresh their listings and seat streams, fill freed seats
+    if not course_ids:
+        return
+    connection = db.session.connection()
+    count_seats(connection, course_ids)
+    refresh_grade_stats(connection, course_ids)
+    stale_course_fragments(db.session, course_ids)
+    note_seat_changes(db.session, course_ids)
+    for course_id in course_ids:
+        promote_waitlist(course_id)
+
+
+# Retry policy for SQLite "database is locked": SQLite allows one writer at a time, so when
+# several enrollments land together the losers get OperationalError once the busy timeout runs out.
+# We roll back and retry the whole transaction up to DB_LOCK_RETRIES times, sleeping
+# DB_LOCK_BACKOFF * 2**attempt seconds (plus jitter) in between, then let the error through.
+DB_LOCK_RETRIES = 5
+DB_LOCK_BACKOFF = 0.05
+
+def retry_on_lock(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(DB_LOCK_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                db.session.rollback()
+                if 'database is locked' not in str(error) or attempt == DB_LOCK_RETRIES:
+                    raise
+                time.sleep(DB_LOCK_BACKOFF * 2 ** attempt * (1 + random.random()))
+    return wrapper
+
+
+# Two meetings overlap when they are in the same term, share a day bit and their [start, end) intervals intersect.
+# indexed=False writes a's term as `term_id + 0`, so the planner cannot range over ix_course_meeting for a:
+# use it when a is one of the student's own courses, reached by primary key from their enrollments.
+def meetings_overlap(a, b, indexed=True):
+    a_term = a.term_id if indexed else a.term_id + db.literal_column("0")
+    return a_term.is_not_distinct_from(b.term_id) & (a.days_mask.op('&')(b.days_mask) != 0) \
+        & (a.start_min < b.end_min) & (b.start_min < a.end_min)
+
+
+def schedule_conflict_query(student_id, course_id):
+    # first course on the student's schedule that overlaps course_id; walks their enrollments, not the catalog
+    new = db.aliased(Course)
+    return (
+        db.select(Course.id, Course.courseName)
+        .select_from(Enrollment)
+        .join(Course, Course.id == Enrollment.course_id)
+        .join(new, new.id == course_id)
+        .where(Enrollment.student_id == student_id, Course.id != course_id, meetings_overlap(Course, new, indexed=False))
+        .limit(1)
+    )
+
+
+def schedule_conflict(student_id, course_id):
+    return db.session.execute(schedule_conflict_query(student_id, course_id)).first()
+
+
+def conflicting_courses_query(student_id):
+    # every catalog course that overlaps something the student is enrolled in: their courses first, then
+    # one ix_course_meeting range per course they take
+    taken = db.aliased(Course)
+    return (
+        db.select(Course.id).distinct()
+        .select_from(Enrollment)
+        .join(taken, taken.id == Enrollment.course_id)
+        .join(Course, meetings_overlap(Course, taken))
+        .where(Enrollment.student_id == student_id, Course.id != taken.id)
+    )
+
+
+def conflicting_courses(student_id):
+    return set(db.session.execute(conflicting_courses_query(student_id)).scalars())
+
+
+def schedule_clashes_query(student_id, course_ids):
+    # the courses among course_ids that overlap the student's schedule, starting from their enrollments
+    taken = db.aliased(Course)
+    return (
+        db.select(Course.id).distinct()
+        .select_from(Enrollment)
+        .join(taken, taken.id == Enrollment.course_id)
+        .join(Course, meetings_overlap(taken, Course, indexed=False))
+        .where(Enrollment.student_id == student_id, Course.id.in_(course_ids), Course.id != taken.id)
+    )
+
+
+@retry_on_lock
+def enroll_student(student, course_id):
+    # returns 'enrolled', 'already', 'conflict' or 'full'
+    if schedule_conflict(student.id, course_id) is not None:
+        return 'conflict'
+    db.session.add(Enrollment(student_id=student.id, course_id=course_id))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return 'already'
+    except CourseFullError:
+        db.session.rollback()
+        return 'full'
+    return 'enrolled'
+
+
+WAITLIST_POSITION_RETRIES = 5 # other students taking the same place in line at the same moment
+
+def join_waitlist(student_id, course_id):
+    # returns the student's place in line (1 = next), or None if already waiting;
+    # any other IntegrityError (e.g. the course was deleted meanwhile) is raised
+    waitlist = Waitlist.__table__
+    next_position = (
+        db.select(db.literal(course_id), db.literal(student_id),
+                  db.func.coalesce(db.func.max(waitlist.c.position), 0) + 1)
+        .where(waitlist.c.course_id == course_id)
+    )
+    waiting = db.select(waitlist.c.id).where(waitlist.c.course_id == course_id, waitlist.c.student_id == student_id)
+    for attempt in range(WAITLIST_POSITION_RETRIES + 1):
+        try:
+            db.session.execute(waitlist.insert().from_select(['course_id', 'student_id', 'position'], next_position))
+            db.session.commit()
+            break
+        except IntegrityError as error:
+            db.session.rollback()
+            if db.session.execute(waiting).first() is not None:
+                return None
+            # only a race for the same position number (unique_waitlist_position) is worth another try
+            if 'waitlist.course_id, waitlist.position' not in str(error) or attempt == WAITLIST_POSITION_RETRIES:
+                raise
+    return db.session.execute(
+        db.select(db.func.count()).select_from(waitlist)
+        .where(waitlist.c.course_id == course_id,
+               waitlist.c.position <= db.select(waitlist.c.position)
+               .where(waitlist.c.course_id == course_id, waitlist.c.student_id == student_id)
+               .scalar_subquery())
+    ).scalar()
+
+
+def promote_waitlist(course_id):
+    # fill free seats from the head of the waitlist inside the caller's transaction, one seek per seat;
+    # the DELETE ... rowcount check means two transactions can never promote the same student
+    free = db.session.execute(
+        db.select(Course.capacity - Course.enrolled_count).where(Course.id == course_id)
+    ).scalar() or 0
+    promoted = []
+    while len(promoted) < free:
+        head = db.session.execute(
+            db.select(Waitlist.id, Waitlist.student_id)
+            .where(Waitlist.course_id == course_id)
+            .order_by(Waitlist.position)
+            .limit(1)
+        ).first()
+        if head is None:
+            break
+        if db.session.execute(db.delete(Waitlist).where(Waitlist.id == head.id)).rowcount == 0:
+            continue # someone else promoted them first
+        already = db.session.execute(
+            db.select(Enrollment.id).where(Enrollment.student_id == head.student_id, Enrollment.course_id == course_id)
+        ).first()
+        if already or schedule_conflict(head.student_id, course_id) is not None:
+            continue # they cannot take the seat, move on to the next in line
+        db.session.add(Enrollment(student_id=head.student_id, course_id=course_id))
+        db.session.flush() # claims the seat
+        promoted.append(head.student_id)
+    return promoted
+
+
+@retry_on_lock
+def checkout(student_id, course_ids, all_or_nothing):
+    # Enroll in a whole cart with a fixed number of statements, however many courses are in it:
+    # load the courses, find existing enrollments and clashes, claim every seat in one conditional
+    # UPDATE ... RETURNING, insert the enrollments in one executemany, commit once.
+    # Returns ({course_id: status}, committed).
+    status = {}
+    wanted = list(dict.fromkeys(course_ids)) # repeats count once
+
+    found = set(db.session.execute(db.select(Course.id).where(Course.id.in_(wanted))).scalars())
+    already = set(db.session.execute(
+        db.select(Enrollment.course_id).where(Enrollment.student_id == student_id, Enrollment.course_id.in_(wanted))
+    ).scalars())
+
+    # clashes with the current schedule, then clashes inside the cart (the earlier course wins)
+    clashes = set(db.session.execute(schedule_clashes_query(student_id, wanted)).scalars())
+    other = db.aliased(Course)
+    cart_pairs = db.session.execute(
+        db.select(Course.id, other.id)
+        .join(other, meetings_overlap(Course, other))
+        .where(Course.id.in_(wanted), other.id.in_(wanted), Course.id != other.id)
+    ).all()
+    order = {course_id: n for n, course_id in enumerate(wanted)}
+    clashes.update(later for earlier, later in cart_pairs if order[earlier] < order[later])
+
+    candidates = []
+    for course_id in wanted:
+        if course_id not in found:
+            status[course_id] = 'not_found'
+        elif course_id in already:
+            status[course_id] = 'already'
+        elif course_id in clashes:
+            status[course_id] = 'conflict'
+        else:
+            candidates.append(course_id)
+
+    if all_or_nothing and status:
+        # something already failed, so leave the seats alone
+        db.session.rollback()
+        status.update({course_id: 'skipped' for course_id in candidates})
+        return status, False
+
+    claimed = set()
+    if candidates:
+        claimed = set(db.session.execute(
+            Course.__table__.update()
+            .where(Course.id.in_(candidates), Course.enrolled_count < Course.capacity)
+            .values(enrolled_count=Course.enrolled_count + 1)
+            .returning(Course.id)
+        ).scalars())
+    for course_id in candidates:
+        status[course_id] = 'enrolled' if course_id in claimed else 'full'
+
+    if not claimed or (all_or_nothing and len(claimed) < len(wanted)):
+        db.session.rollback()
+        status.update({course_id: 'rolled_back' for course_id in claimed})
+        return status, False
+
+    try:
+        db.session.execute(Enrollment.__table__.insert(),
+                           [{"student_id": student_id, "course_id": course_id} for course_id in claimed])
+    except IntegrityError:
+        # the same student enrolled through another request in the meantime
+        db.session.rollback()
+        return {course_id: 'retry' for course_id in course_ids}, False
+    # plain INSERTs skip the ORM hooks, so update grade stats and tell the caches and the seat stream ourselves
+    default_grade = Enrollment.__table__.c.grade.default.arg
+    apply_grade_changes(db.session.connection(), {course_id: ((), (default_grade,)) for course_id in claimed})
+    stale_course_fragments(db.session, claimed)
+    note_seat_changes(db.session, claimed)
+    db.session.commit()
+    return status, True
+
+#  ------------------------------------------------------------------------------------------  #
+
+
+# Password hashing: PBKDF2/scrypt run in a bounded process pool so a login storm cannot eat the
+# request workers. When every worker is busy and the queue is full we answer 503 + Retry-After.
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+_hash_pool = None
+_hash_slots = None
+_hash_pool_lock = threading.Lock()
+# hashing workers never fork() this process: the pool starts lazily from a request thread while
+# other threads may hold locks (logging, the engine pool) that a forked child would inherit held
+HASH_POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+def run_hash_job(func, *args):
+    global _hash_pool, _hash_slots
+    workers = app.config["PASSWORD_HASH_WORKERS"]
+    if not workers:
+        return func(*args)
+
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(max_workers=workers, mp_context=HASH_POOL_CONTEXT)
+            _hash_slots = threading.BoundedSemaphore(workers + app.config["PASSWORD_HASH_QUEUE"])
+
+    if not _hash_slots.acquire(blocking=False):
+        raise PasswordPoolBusy()
+    try:
+        return _hash_pool.submit(func, *args).result()
+    finally:
+        _hash_slots.release()
+
+
+def hash_password(password):
+    return run_hash_job(generate_password_hash, password, app.config["PASSWORD_HASH_METHOD"])
+
+
+def verify_password(stored, password):
+    return run_hash_job(check_password_hash, stored, password)
+
+
+def is_password_hash(stored):
+    return stored.startswith(('pbkdf2:', 'scrypt:'))
+
+
+@functools.lru_cache(maxsize=None)
+def hash_prefix(method):
+    # "pbkdf2:sha256:600000" etc, as werkzeug writes it in front of the salt
+    return generate_password_hash('', method=method, salt_length=1).split('$', 1)[0]
+
+
+def password_needs_rehash(stored):
+    return stored.split('$', 1)[0] != hash_prefix(app.config["PASSWORD_HASH_METHOD"])
+
+
+@app.errorhandler(PasswordPoolBusy)
+def password_pool_busy(error):
+    return jsonify({"error": "Too many logins right now, try again shortly"}), 503, {"Retry-After": "1"}
+
+
+@app.cli.command('hash-benchmark')
+@click.option('--seconds', default=2.0, help='How long to run each method.')
+@click.argument('methods', nargs=-1)
+def hash_benchmark(seconds, methods):
+    # logins per second (one check_password_hash each) for every method across the worker pool
+    workers = app.config["PASSWORD_HASH_WORKERS"] or 1
+    methods = methods or (app.config["PASSWORD_HASH_METHOD"], "pbkdf2:sha256:260000", "scrypt:32768:8:1")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=HASH_POOL_CONTEXT) as pool:
+        for method in methods:
+            stored = generate_password_hash('benchmark', method=method)
+            logins, start = 0, time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                logins += sum(pool.map(check_password_hash, [stored] * workers, ['benchmark'] * workers))
+            rate = logins / (time.perf_counter() - start)
+            print(f"{method:28} {rate:10.1f} logins/s {rate / workers:10.1f} per core ({workers} workers)")
+
+
+#  ------------------------------------------------------------------------------------------  #
+# Fragment cache: rendered pieces of the course listings (catalog rows, a teacher's course table)
+# are shared by every user until a commit touches the Course, Enrollment or Teacher rows behind
+# them. Per-user parts of the pages (welcome header, flashed messages, conflict marks) are never cached.
+
+class LRUCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries, self.ttl = max_entries, ttl
+        self.entries = OrderedDict() # key -> (expires, value)
+        self.versions = {}           # key -> times invalidated, stops a slow render storing stale html
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def version(self, key):
+        with self.lock:
+            return self.versions.get(key, 0)
+
+    def set(self, key, value, version=0):
+        with self.lock:
+            if self.versions.get(key, 0) != version:
+                return # invalidated while we were rendering
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+                self.versions[key] = self.versions.get(key, 0) + 1
+
+    def stats(self):
+        return {"backend": "lru", "entries": len(self.entries), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+class SharedCache:
+    # any client with get/mget/set(ex=)/incr/delete, e.g. redis.Redis; the server does its own evicting.
+    # Like LRUCache.versions, a per-key counter in the server (INCR on delete) keeps a render that started
+    # before an invalidation from storing stale html: set() compares it first, and since another process
+    # can still invalidate between that check and the SET, values are stored as [version, value] and
+    # get() treats one written under an older version as a miss.
+    def __init__(self, client, ttl, prefix='fragment:'):
+        self.client, self.ttl, self.prefix = client, ttl, prefix
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        raw, version = self.client.mget(self.prefix + key, self.prefix + 'version:' + key)
+        if raw is not None:
+            stored_version, value = json.loads(raw)
+            if stored_version == int(version or 0):
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def version(self, key):
+        return int(self.client.get(self.prefix + 'version:' + key) or 0)
+
+    def set(self, key, value, version=0):
+        if self.version(key) != version:
+            return # invalidated while we were rendering
+        self.client.set(self.prefix + key, json.dumps([version, value]), ex=self.ttl)
+
+    def delete(self, keys):
+        for key in keys:
+            self.client.incr(self.prefix + 'version:' + key)
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def stats(self):
+        return {"backend": "shared", "hits": self.hits, "misses": self.misses, "evictions": 0}
+
+
+def make_fragment_cache(config):
+    if config["FRAGMENT_CACHE_REDIS_URL"]:
+        import redis # only needed for the shared backend
+        return SharedCache(redis.Redis.from_url(config["FRAGMENT_CACHE_REDIS_URL"]), config["FRAGMENT_CACHE_TTL"])
+    return LRUCache(config["FRAGMENT_CACHE_SIZE"], config["FRAGMENT_CACHE_TTL"])
+
+
+fragment_cache = make_fragment_cache(app.config)
+
+def cached_fragment(key, render):
+    value = fragment_cache.get(key)
+    if value is None:
+        version = fragment_cache.version(key)
+        with reading_from_primary():
+            value = render()
+        fragment_cache.set(key, value, version)
+    return value
+
+
+def catalog_fragment_key(term_id):
+    return f"catalog:{term_id}"
+
+
+def teacher_fragment_key(teacher_id, term_id):
+    return f"teacher_courses:{teacher_id}:{term_id}"
+
+
+def stale_course_fragments(session, course_ids=None):
+    # fragments showing these courses (all courses when None) are dropped when the session commits
+    query = db.select(Course.teacher_id, Course.term_id).distinct()
+    if course_ids is not None:
+        query = query.where(Course.id.in_(course_ids))
+    keys = session.info.setdefault('stale_fragments', set())
+    for teacher_id, term_id in session.execute(query):
+        keys.add(catalog_fragment_key(term_id))
+        if teacher_id is not None:
+            keys.add(teacher_fragment_key(teacher_id, term_id))
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def collect_stale_fragments(session, flush_context):
+    keys = session.info.setdefault('stale_fragments', set())
+    course_ids, teacher_ids = set(), set()
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        state = db.inspect(obj)
+        if isinstance(obj, Course):
+            teachers = [teacher_id for teacher_id in [obj.teacher_id, *state.attrs.teacher_id.history.deleted]
+                        if teacher_id is not None]
+            for term_id in [obj.term_id, *state.attrs.term_id.history.deleted]:
+                keys.add(catalog_fragment_key(term_id))
+                keys.update(teacher_fragment_key(teacher_id, term_id) for teacher_id in teachers)
+        elif isinstance(obj, Teacher):
+            teacher_ids.add(obj.id) # their name shows in every term they teach
+        elif isinstance(obj, Enrollment):
+            history = state.attrs.course_id.history
+            if obj in session.dirty and not history.has_changes():
+                continue # grade edits do not show up in the listings
+            course_ids.update(course_id for course_id in [obj.course_id, *history.deleted] if course_id is not None)
+    if course_ids:
+        stale_course_fragments(session, course_ids)
+    if teacher_ids:
+        stale_course_fragments(session, db.select(Course.id).where(Course.teacher_id.in_(teacher_ids)))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def drop_stale_fragments(session):
+    fragment_cache.delete(session.info.pop('stale_fragments', ()))
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def keep_fragments(session):
+    session.info.pop('stale_fragments', None)
+
+
+#  ------------------------------------------------------------------------------------------  #
+# Live seat counts: commits that change enrollments publish the new "enrolled / capacity" of those
+# courses here, and every open /seats/stream picks up whatever changed since it last looked. A
+# subscriber only keeps the version it has seen, so bursts coalesce and memory per stream stays flat.
+
+class SeatBroker:
+    def __init__(self):
+        self.seats = {} # course_id -> (version, enrolled, capacity)
+        self.version = 0
+        self.subscribers = 0
+        self.condition = threading.Condition()
+
+    def publish(self, seats):
+        with self.condition:
+            self.version += 1
+            for course_id, (enrolled, capacity) in seats.items():
+                self.seats[course_id] = (self.version, enrolled, capacity)
+            self.condition.notify_all()
+
+    def wait(self, since, timeout):
+        # (latest version, {course_id: [enrolled, capacity]} changed after since)
+        with self.condition:
+            self.condition.wait_for(lambda: self.version > since, timeout=timeout)
+            changed = {course_id: [enrolled, capacity] for course_id, (version, enrolled, capacity)
+                       in self.seats.items() if version > since}
+            return self.version, changed
+
+    def subscribe(self, limit):
+        with self.condition:
+            if self.subscribers >= limit:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+
+seat_broker = SeatBroker()
+
+def note_seat_changes(session, course_ids):
+    session.info.setdefault('seat_changes', set()).update(course_ids)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def collect_seat_changes(session, flush_context):
+    for obj in itertools.chain(session.new, session.deleted):
+        if isinstance(obj, Enrollment):
+            note_seat_changes(session, [obj.course_id])
+    for obj in session.dirty:
+        if isinstance(obj, Enrollment):
+            note_seat_changes(session, db.inspect(obj).attrs.course_id.history.sum())
+        elif isinstance(obj, Course):
+            note_seat_changes(session, [obj.id])
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def publish_seat_changes(session):
+    course_ids = session.info.pop('seat_changes', None)
+    if not course_ids:
+        return
+    with db.engine.connect() as connection: # the session itself is mid-commit here
+        rows = connection.execute(
+            db.select(Course.id, Course.enrolled_count, Course.capacity).where(Course.id.in_(course_ids))
+        ).all()
+    seat_broker.publish({row.id: (row.enrolled_count, row.capacity) for row in rows})
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_seat_changes(session):
+    session.info.pop('seat_changes', None)
+
+
+#  ------------------------------------------------------------------------------------------  #
+
+
+# Admin edits to an account must not be served from the identity cache afterwards
+class IdentityCacheMixin:
+    def after_model_change(self, form, model, is_created):
+        forget_identity(model)
+        super().after_model_change(form, model, is_created)
+
+    def after_model_delete(self, model):
+        forget_identity(model)
+        super().after_model_delete(model)
+
+
+# Admin list pages on the big tables. Related rows shown in the list are joined into the page
+# query (column_select_related_list), sorting is limited to indexed columns, and search matches the
+# start of each searchable column so the NOCASE indexes apply. An unfiltered list reuses its row
+# count for ADMIN_COUNT_CACHE_TTL seconds instead of running COUNT(*) on every page.
+admin_counts = {} # table name -> (rows, expires)
+
+def prefix_match(fields, text):
+    # LIKE 'text%' on any of the fields, with LIKE's wildcards in the text escaped
+    pattern = re.sub(r'([\\%_])', r'\\\1', text.strip()) + '%'
+    return db.or_(*[field.like(pattern, escape='\\') for field in fields])
+
+
+class CachedCount:
+    def __init__(self, query, key):
+        self.query, self.key = query, key
+
+    def scalar(self):
+        rows, expires = admin_counts.get(self.key, (None, 0))
+        if expires < time.monotonic():
+            rows = self.query.scalar()
+            admin_counts[self.key] = (rows, time.monotonic() + app.config["ADMIN_COUNT_CACHE_TTL"])
+        return rows
+
+
+class FastListMixin:
+    def get_list(self, page, sort_column, sort_desc, search, filters, *args, **kwargs):
+        g.admin_unfiltered = not search and not filters
+        return super().get_list(page, sort_column, sort_desc, search, filters, *args, **kwargs)
+
+    def get_count_query(self):
+        query = super().get_count_query()
+        if app.config["ADMIN_COUNT_CACHE_TTL"] and g.get('admin_unfiltered'):
+            return CachedCount(query, self.model.__tablename__)
+        return query
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        # the whole search text, e.g. "cse 1", must be the start of one of the searchable columns
+        clause = prefix_match([field for field, path in self._search_fields], search)
+        query = query.filter(clause)
+        if count_query is not None:
+            count_query = count_query.filter(clause)
+        return query, count_query, joins, count_joins
+
+    def create_model(self, form):
+        admin_counts.pop(self.model.__tablename__, None)
+        return super().create_model(form)
+
+
+# Set-based deletes for the admin. Each chunk of ADMIN_BULK_CHUNK selected ids is one DELETE or
+# UPDATE statement committed on its own, so the write lock is only held briefly; the database
+# cascades to enrollments, waitlists and stats (or unassigns courses), and the affected courses are
+# repaired in the same transaction. Deleting one row from its page goes through the same path.
+def delete_students(ids):
+    enrollment = Enrollment.__table__
+    selected = enrollment.c.student_id.in_(ids)
+    course_ids = db.session.execute(db.select(enrollment.c.course_id).distinct().where(selected)).scalars().all()
+    enrollments = db.session.execute(db.select(db.func.count()).select_from(enrollment).where(selected)).scalar()
+    students = db.session.execute(User.__table__.delete().where(User.__table__.c.id.in_(ids))).rowcount
+    forget_identities('student', ids)
+    repair_courses(course_ids)
+    return {"students": students, "enrollments": enrollments}
+
+
+def drop_student_enrollments(ids):
+    enrollment = Enrollment.__table__
+    selected = enrollment.c.student_id.in_(ids)
+    course_ids = db.session.execute(db.select(enrollment.c.course_id).distinct().where(selected)).scalars().all()
+    enrollments = db.session.execute(enrollment.delete().where(selected)).rowcount
+    repair_courses(course_ids)
+    return {"enrollments": enrollments}
+
+
+def delete_teachers(ids):
+    course = Course.__table__
+    stale_course_fragments(db.session, db.select(course.c.id).where(course.c.teacher_id.in_(ids)))
+    courses = db.session.execute(db.select(db.func.count()).select_from(course).where(course.c.teacher_id.in_(ids))).scalar()
+    teachers = db.session.execute(Teacher.__table__.delete().where(Teacher.__table__.c.id.in_(ids))).rowcount
+    forget_identities('teacher', ids)
+    return {"teachers": teachers, "courses": courses}
+
+
+def delete_courses(ids):
+    enrollment = Enrollment.__table__
+    stale_course_fragments(db.session, ids)
+    enrollments = db.session.execute(
+        db.select(db.func.count()).select_from(enrollment).where(enrollment.c.course_id.in_(ids))).scalar()
+    courses = db.session.execute(Course.__table__.delete().where(Course.__table__.c.id.in_(ids))).rowcount
+    return {"courses": courses, "enrollments": enrollments}
+
+
+def clear_course_enrollments(ids):
+    # term cleanup: empty the courses, waitlists included so nobody is promoted into the freed seats
+    enrollment, waitlist = Enrollment.__table__, Waitlist.__table__
+    waitlisted = db.session.execute(waitlist.delete().where(waitlist.c.course_id.in_(ids))).rowcount
+    enrollments = db.session.execute(enrollment.delete().where(enrollment.c.course_id.in_(ids))).rowcount
+    repair_courses(ids)
+    return {"enrollments": enrollments, "waitlisted": waitlisted}
+
+
+def delete_enrollments(ids):
+    enrollment = Enrollment.__table__
+    course_ids = db.session.execute(
+        db.select(enrollment.c.course_id).distinct().where(enrollment.c.id.in_(ids))).scalars().all()
+    enrollments = db.session.execute(enrollment.delete().where(enrollment.c.id.in_(ids))).rowcount
+    repair_courses(course_ids)
+    return {"enrollments": enrollments}
+
+
+@retry_on_lock
+def run_chunk(work, chunk):
+    counts = work(chunk)
+    db.session.commit()
+    return counts
+
+
+class BulkActionsMixin:
+    bulk_delete = None    # work function for the "Delete" action, returns {name: rows}
+    delete_message = None # flashed with those counts
+
+    def run_bulk(self, ids, work, message=None): # message None: only failures are flashed
+        totals, done = Counter(), 0
+        try:
+            for chunk in chunked(sorted({int(id) for id in ids}), app.config["ADMIN_BULK_CHUNK"]):
+                totals.update(run_chunk(work, chunk))
+                done += len(chunk)
+        except Exception as error:
+            db.session.rollback()
+            flash(f"Stopped after {done} of {len(ids)} selected rows: {error}", 'error')
+            return False
+        finally:
+            admin_counts.pop(self.model.__tablename__, None)
+        if message:
+            flash(message.format_map(totals))
+        return True
+
+    @action('delete', 'Delete', 'Delete the selected rows and everything that depends on them?')
+    def action_delete(self, ids):
+        self.run_bulk(ids, type(self).bulk_delete, self.delete_message)
 
+    def delete_model(self, model): # Flask-Admin flashes its own "Record was successfully deleted."
+        return self.run_bulk([model.id], type(self).bulk_delete)
 
-class UserView(ModelView):
+
+# Type-ahead pickers for the relationship fields of the admin forms: the typed text must be the
+# start of one of the fields (NOCASE indexes again), and at most ADMIN_AJAX_LIMIT rows come back,
+# so opening a form no longer ships every student, course or teacher to the browser.
+class PrefixAjaxLoader(QueryAjaxModelLoader):
+    def get_list(self, term, offset=0, limit=None):
+        query = self.get_query().filter(prefix_match(self._cached_fields, term))
+        limit = min(limit or app.config["ADMIN_AJAX_LIMIT"], app.config["ADMIN_AJAX_LIMIT"])
+        return query.offset(offset).limit(limit).all()
+
+
+class UserView(IdentityCacheMixin, BulkActionsMixin, FastListMixin, ModelView):
     # def is_accessible(self):
         # return current_user.is_authenticated and current_user.role == 'admin'
     #pass
     form_columns = ["studentName", "email", "password", "role"]  #should not display passwords
     column_list = ["studentName","email" ,"password", "role"]
+    column_searchable_list = ["studentName", "email"]
+    column_sortable_list = ["studentName", "email"]
+    bulk_delete = delete_students
+    delete_message = "Deleted {students} students and {enrollments} of their enrollments."
+
+    @action('drop_enrollments', 'Drop all enrollments', 'Drop every enrollment of the selected students?')
+    def action_drop_enrollments(self, ids):
+        self.run_bulk(ids, drop_student_enrollments, "Dropped {enrollments} enrollments.")
     form_args = {
         'studentName': {
             'label': 'Student Name',
@@ -156,10 +1592,12 @@ class UserView(ModelView):
         },
     }
 
-class TeacherView(ModelView):
+class TeacherView(IdentityCacheMixin, BulkActionsMixin, ModelView):
     # def is_accessible(self):
         # return current_user.is_authenticated and current_user.role == 'admin'
     #pass
+    bulk_delete = delete_teachers
+    delete_message = "Deleted {teachers} teachers, {courses} of their courses now have no teacher."
     form_columns = ["teacherName", "email", "password", "role"]  #should not display passwords
     column_list = ["teacherName", "email", "password", "role"]
     form_args = {
@@ -182,12 +1620,24 @@ class TeacherView(ModelView):
 
     }
 
-class CourseView(ModelView):
+class CourseView(BulkActionsMixin, FastListMixin, ModelView):
     def is_accessible(self):
         return current_user.is_authenticated and current_user.role == 'admin'
     #pass
-    form_columns = ["courseName", "teacher", "time", "capacity"]
-    column_list = ["courseName", "teacher", "time", "capacity"]
+    form_columns = ["courseName", "term", "teacher", "time", "capacity"]
+    column_list = ["courseName", "term", "teacher", "time", "capacity"]
+    column_select_related_list = [Course.teacher, Course.term]
+    column_searchable_list = ["courseName"]
+    column_sortable_list = ["courseName", ("teacher", "teacher_id")]
+    form_ajax_refs = {
+        'teacher': PrefixAjaxLoader('teacher', db.session, Teacher, fields=['teacherName', 'email']),
+    }
+    bulk_delete = delete_courses
+    delete_message = "Deleted {courses} courses and {enrollments} enrollments in them."
+
+    @action('clear_enrollments', 'Clear enrollments', 'Remove every enrollment and waitlist entry of the selected courses?')
+    def action_clear_enrollments(self, ids):
+        self.run_bulk(ids, clear_course_enrollments, "Removed {enrollments} enrollments and {waitlisted} waitlist entries.")
 
     form_args = {
         'courseName': {
@@ -206,20 +1656,39 @@ class CourseView(ModelView):
             'label': 'Teacher',
             'description': 'Select the teacher for this course.',
         },
+        'term': {
+            'label': 'Term',
+            'description': 'Leave empty for the active term.',
+        },
 
     }
     column_formatters = { #changes how 'teacher' it displays in flask_admin /Course tab
-        'teacher': lambda v, c, m, p: f'{m.teacher.teacherName} ({m.teacher.email})' if m.teacher else None
+        'teacher': lambda v, c, m, p: f'{m.teacher.teacherName} ({m.teacher.email})' if m.teacher else None,
+        'term': lambda v, c, m, p: m.term.name if m.term else None,
     }
 
+    def on_model_change(self, form, model, is_created):
+        # raising capacity lets waitlisted students in, in the same commit as the edit
+        if not is_created:
+            promote_waitlist(model.id)
+
 
 
-class EnrollmentView(ModelView):
+class EnrollmentView(BulkActionsMixin, FastListMixin, ModelView):
     def is_accessible(self):
         return current_user.is_authenticated and current_user.role == 'admin'
     #pass
     form_columns = ["student", "course", "grade" ]  
     column_list = ["student", "course", "grade" ]
+    column_select_related_list = [Enrollment.student, Enrollment.course]
+    column_sortable_list = [("student", "student_id"), ("course", "course_id")]
+    column_filters = ["student_id", "course_id"] # equality on the indexed keys
+    bulk_delete = delete_enrollments # freed seats go to the waitlist too
+    delete_message = "Deleted {enrollments} enrollments."
+    form_ajax_refs = {
+        'student': PrefixAjaxLoader('student', db.session, User, fields=['studentName', 'email']),
+        'course': PrefixAjaxLoader('course', db.session, Course, fields=['courseName']),
+    }
     form_args = {
         'student': {
             'label': 'Student',
@@ -235,7 +1704,33 @@ class EnrollmentView(ModelView):
         },
     }
 
-class AdminLoginView(ModelView):
+class TermView(ModelView):
+    def is_accessible(self):
+        return current_user.is_authenticated and current_user.role == 'admin'
+    form_columns = ["name", "active", "closed"]
+    column_list = ["name", "active", "closed", "archived"]
+    form_args = {
+        'name': {
+            'label': 'Term Name',
+            'description': 'Enter the term name, e.g. "Fall 2024".'
+        },
+        'active': {
+            'label': 'Active',
+            'description': 'The term students and teachers see by default, only one term is active.'
+        },
+        'closed': {
+            'label': 'Closed',
+            'description': 'Grades are final; `flask archive-terms` moves closed terms to the archive.'
+        },
+    }
+
+    def on_model_change(self, form, model, is_created):
+        # making a term active retires the previous one in the same commit
+        if model.active:
+            self.session.flush()
+            self.session.execute(db.update(Term).where(Term.id != model.id).values(active=False))
+
+class AdminLoginView(IdentityCacheMixin, ModelView):
     # def is_accessible(self):
         # return current_user.is_authenticated and current_user.role == 'admin'
     pass
@@ -248,9 +1743,7 @@ class MyAdminIndexView(AdminIndexView):
         role = session.get('role', None)
 
         if current_user.is_authenticated:
-            print(f"----email-----{current_user.email}")
-            print(f"----role-----{current_user.role}")
-            print(f"----session.role-----{role}")
+            app.logger.debug("admin index: email=%s role=%s session role=%s", current_user.email, current_user.role, role)
 
             if current_user.role == 'admin' and role == 'admin':
                 # Print the session role before redirecting
@@ -270,6 +1763,7 @@ admin = Admin(app, index_view=MyAdminIndexView())
 admin.add_view(UserView(User, db.session))
 admin.add_view(TeacherView(Teacher, db.session))
 admin.add_view(CourseView(Course, db.session))
+admin.add_view(TermView(Term, db.session))
 admin.add_view(EnrollmentView(Enrollment, db.session))
 admin.add_view(AdminLoginView(AdminLogin, db.session))
 
@@ -320,7 +1814,7 @@ def register_backend():
     else:
         role = 'student'
 
-    hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+    hashed_password = hash_password(password)
 
     if account_type == "teacher":
         new_user = Teacher(teacherName=name, email=email, password=hashed_password, role=role)
@@ -351,15 +1845,20 @@ def login_backend():
  
     # Check if the email ends with "@type" and assign role at login
     if user is not None:
-        if not user.password.startswith('$pbkdf2'):
+        if not is_password_hash(user.password):
 
             if (user.password == Password):
-                print("passed commited!")
-                hashed_password = generate_password_hash(Password, method='pbkdf2:sha256')
+                app.logger.debug("upgraded plain-text password for %s", Email)
+                hashed_password = hash_password(Password)
                 user.password = hashed_password
                 db.session.commit()
 
-        if check_password_hash(user.password, Password):
+        if verify_password(user.password, Password):
+
+            # stored with older hash settings: upgrade it now that we know the password
+            if password_needs_rehash(user.password):
+                user.password = hash_password(Password)
+                db.session.commit()
 
             # login_user(user, remember=True)  # Use Flask-Login's login_user function here
             # print(f"----login_user--print-----{current_user}")
@@ -372,7 +1871,7 @@ def login_backend():
                 session['admin'] = True
                 session['teacher'] = False
 
-                print(f"----login_user--print-----{current_user}")
+                app.logger.debug("logged in %s", current_user)
 
                 # session_role = session.get('role')
                 # print(f"---F---Session Role: {session_role}")
@@ -387,7 +1886,7 @@ def login_backend():
                 session['teacher'] = True
                 session['admin'] = False
 
-                print(f"----login_user--print-----{current_user}")
+                app.logger.debug("logged in %s", current_user)
                 return redirect(url_for('teacher_view', teacher_id=user.id))
 
             else:
@@ -398,7 +1897,7 @@ def login_backend():
                 session['teacher'] = False
 
                 #return f"Logged in as {user.username} with role {user.role}"
-                return redirect(url_for('student_view', name=user.studentName))
+                return redirect(url_for('student_view', student_id=user.id))
 
         else:
             flash('Password is incorrect: try again')
@@ -413,114 +1912,317 @@ def login_backend():
 # --------------------------------------------------------------------------------------------------------------- #
 
 
-# Function to load a student's name
-def loadstudent(name):
+# Function to load the logged in student (already loaded by load_user, so no query)
+def loadstudent(student_id=None):
 
-    student = User.query.filter_by(studentName=name).first()
-    return student
+    if not isinstance(current_user, User) or student_id not in (None, current_user.id):
+        flash('You do not have access to this page.')
+        abort(403) # Abort the request with a 403 Forbidden error
+    return current_user._get_current_object()
 
 
 # Student: View
-@app.route('/student_view/<name>')
+@app.route('/student_view/<int:student_id>')
+@read_only
 @login_required
-def student_view(name):
-    check = session.get('email', None)
-
-    # Filter student by name
-    student = User.query.filter_by(studentName=name).first()
-
-    if student.email != check:
-        flash('You do not have access to this page.')
-        return abort(403) # Abort the request with a 403 Forbidden error
-    
-    # Find what classes they are enrolled into
-    enrollments = Enrollment.query.filter_by(student=student).all()
+def student_view(student_id):
+    # The logged in student, 403 for anyone else
+    student = loadstudent(student_id)
     
-    # Extract courses from the student's enrollment
-    courses = [enrollment.course for enrollment in enrollments]
+    # The courses they are enrolled into this term, with teacher and seat count, in one query
+    courses = student_courses(student.id, requested_term_id())
 
     # Render it into student html 
     return render_template('student.html', student=student, courses=courses, current_user=student)
 
 
+# Dashboard rows: enrollment join course join teacher, seat counts come from Course.enrolled_count.
+# Driven from the student's enrollments; `term_id + 0` keeps the planner off the (term_id, courseName)
+# index, which would walk every course of the term and probe enrollment for each one.
+def student_courses_query(student_id, term_id):
+    return (
+        db.select(Course.id, Course.courseName, Course.time, Course.capacity,
+                  Course.enrolled_count, Teacher.teacherName)
+        .select_from(Enrollment)
+        .join(Course, Enrollment.course_id == Course.id)
+        .outerjoin(Teacher, Course.teacher_id == Teacher.id)
+        .where(Enrollment.student_id == student_id, (Course.term_id + 0) == term_id)
+        .order_by(Course.courseName, Course.id)
+    )
+
+
+def student_courses(student_id, term_id):
+    return db.session.execute(student_courses_query(student_id, term_id)).all()
+
+
+# Course catalog rows of a term: one query joining Teacher, seat counts come from Course.enrolled_count
+def course_catalog(term_id):
+    return db.session.execute(
+        db.select(Course.id, Course.courseName, Course.time, Course.capacity,
+                  Course.enrolled_count, Teacher.teacherName)
+        .outerjoin(Teacher, Course.teacher_id == Teacher.id)
+        .where(Course.term_id == term_id)
+        .order_by(Course.courseName, Course.id)
+    ).all()
+
+
+# [course id, rendered <td> cells, full] for every catalog row of a term, cached as one fragment
+def render_catalog_rows(term_id):
+    catalog_row = get_template_attribute('fragments.html', 'catalog_row')
+    return [[course.id, str(catalog_row(course)), course.enrolled_count >= course.capacity]
+            for course in course_catalog(term_id)]
+
+
+# Course catalog API: one term (?term=, the active one by default), keyset pagination on
+# (courseName, id), capped page size
+COURSE_PAGE_SIZE = 25
+COURSE_PAGE_MAX = 100
+
+def parse_flag(value):
+    # query string booleans: "1", "true", "yes", "on" and "0", "false", "no", "off" or empty
+    value = value.strip().lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('', '0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f"not a boolean: {value}")
+
+
+@app.route('/api/courses')
+@read_only
+@login_required
+def course_catalog_api():
+    try:
+        limit = min(max(int(request.args.get('limit', COURSE_PAGE_SIZE)), 1), COURSE_PAGE_MAX)
+        days = parse_days(request.args.get('days', ''))
+        teacher_id = request.args.get('teacher_id', type=int)
+        open_only = parse_flag(request.args.get('open', ''))
+    except ValueError:
+        return jsonify({"error": "Invalid query parameters"}), 400
+
+    query = (
+        db.select(Course.id, Course.courseName, Course.time, Course.capacity,
+                  Course.enrolled_count, Teacher.teacherName)
+        .outerjoin(Teacher, Course.teacher_id == Teacher.id)
+        .where(Course.term_id == requested_term_id())
+    )
+
+    # "CSE" or "CSE 1" style prefix, written as a range so it can use ix_course_name_id
+    prefix = request.args.get('prefix')
+    if prefix:
+        query = query.where(Course.courseName >= prefix, Course.courseName < prefix + '\uffff')
+    if teacher_id is not None:
+        query = query.where(Course.teacher_id == teacher_id)
+    if request.args.get('teacher'):
+        query = query.where(Teacher.teacherName == request.args['teacher'])
+    if days:
+        query = query.where(Course.days_mask.op('&')(~days) == 0) # only meets on the requested days
+    if open_only:
+        query = query.where(Course.enrolled_count < Course.capacity)
+
+    # cursor is "<courseName>|<id>" of the last row of the previous page
+    cursor = request.args.get('cursor')
+    if cursor:
+        after_name, _, after_id = cursor.rpartition('|')
+        if not after_id.isdigit():
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.where(tuple_(Course.courseName, Course.id) > (after_name, int(after_id)))
+
+    rows = db.session.execute(query.order_by(Course.courseName, Course.id).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1].courseName}|{rows[-1].id}"
+
+    return jsonify({
+        "courses": [{
+            "id": row.id,
+            "courseName": row.courseName,
+            "teacher": row.teacherName,
+            "time": row.time,
+            "enrolled": row.enrolled_count,
+            "capacity": row.capacity,
+        } for row in rows],
+        "next_cursor": next_cursor,
+    })
+
+
 # Student: Display all courses
-@app.route('/all_courses/<name>')
+@app.route('/all_courses/<int:student_id>')
+@read_only
 @login_required
-def all_courses(name):
+def all_courses(student_id):
 
-    check = session.get('email', None)
+    # The logged in student, 403 for anyone else
+    student = loadstudent(student_id)
     
-    # Filter student by name
-    student = User.query.filter_by(studentName=name).first()
+    # Catalog rows of the term come from the fragment cache, rendered from one query on a miss
+    term_id = requested_term_id()
+    all_courses = cached_fragment(catalog_fragment_key(term_id), lambda: render_catalog_rows(term_id))
 
-    if student.email != check:
-        flash('You do not have access to this page.')
-        return abort(403) # Abort the request with a 403 Forbidden error
-    
-    # Retrieve all available courses
-    all_courses = Course.query.all()
+    # Courses that overlap the student's schedule
+    conflicts = conflicting_courses(student.id)
     
     # Return into student all html
-    return render_template('studentall.html', student=student, courses=all_courses, current_user = student)
+    return render_template('studentall.html', student=student, courses=all_courses, conflicts=conflicts, current_user = student)
+
+
+# Student: Live seat counts as Server-Sent Events, {"<course id>": [enrolled, capacity], ...}
+@app.route('/seats/stream')
+@login_required
+def seat_stream():
+    if not seat_broker.subscribe(app.config["SEAT_STREAM_MAX"]):
+        return jsonify({"error": "Too many open seat streams"}), 503, {"Retry-After": "5"}
+    interval = app.config["SEAT_STREAM_INTERVAL"]
+    keepalive = app.config["SEAT_STREAM_KEEPALIVE"]
+    db.session.remove() # the stream never touches the database, so do not hold a connection open
+
+    def stream():
+        version = seat_broker.version
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                version, changed = seat_broker.wait(version, keepalive)
+                yield f"data: {json.dumps(changed)}\n\n" if changed else ": keepalive\n\n"
+                time.sleep(interval) # let a burst of commits pile up into the next event
+        finally:
+            seat_broker.unsubscribe()
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 # Student: Add a Course
 @app.route('/add_course/<int:course_id>', methods=['POST'])
+@login_required
 def add_course(course_id):
     
     # Get course by ID
     course = Course.query.get(course_id)
     
-    # Get student name from request form
-    name = request.form['name']
+    # The logged in student
+    student = loadstudent()
     
-    # Load student by name
-    student = loadstudent(name)
-    
-    # Check if an existing student is enrolled
-    existing_student = Enrollment.query.filter_by(student=student, course=course).first()
-    if existing_student:
+    if course is None:
+        abort(404)
+
+    # Claim a seat and insert the enrollment in one transaction
+    status = enroll_student(student, course.id)
+    if status == 'already':
         flash("Already enrolled in this course!")
-        return redirect(url_for('all_courses', name=name))
-    
-    # Check if course has capacity
-    if course.capacity > len(course.enrollments):
-        enrollment = Enrollment(student=student, course=course)
-        db.session.add(enrollment)  
-        db.session.commit()
-        return redirect(url_for('all_courses', name = name))
-    else:
+    elif status == 'conflict':
+        flash('This course conflicts with your current schedule.')
+    elif status == 'full':
         flash('The course is currently full.')
-        return redirect(url_for('all_courses', name = name))
+    return redirect(url_for('all_courses', student_id=student.id))
+
+
+# Student: Checkout a cart, JSON {"course_ids": [1, 2, 3], "mode": "all" or "best_effort"}
+@app.route('/checkout', methods=['POST'])
+@login_required
+def checkout_view():
+
+    # The logged in student
+    student = loadstudent()
+
+    cart = request.get_json(silent=True) or {}
+    course_ids = cart.get('course_ids')
+    mode = cart.get('mode', 'all')
+    if not isinstance(course_ids, list) or not all(isinstance(course_id, int) for course_id in course_ids) \
+            or mode not in ('all', 'best_effort'):
+        return jsonify({"error": "Expected course_ids (list of ids) and mode 'all' or 'best_effort'"}), 400
+
+    status, committed = checkout(student.id, course_ids, all_or_nothing=(mode == 'all'))
+    return jsonify({
+        "mode": mode,
+        "committed": committed,
+        "results": [{"course_id": course_id, "status": status[course_id]} for course_id in dict.fromkeys(course_ids)],
+    })
+
+
+# Student: Join the waitlist of a full course
+@app.route('/join_waitlist/<int:course_id>', methods=['POST'])
+@login_required
+@retry_on_lock
+def join_waitlist_view(course_id):
+
+    # The logged in student
+    student = loadstudent()
+
+    course = db.session.get(Course, course_id)
+    if course is None:
+        abort(404)
+    if Enrollment.query.filter_by(student_id=student.id, course_id=course_id).first():
+        flash("Already enrolled in this course!")
+    elif course.enrolled_count < course.capacity:
+        flash('This course still has open seats, enroll instead.')
+    else:
+        try:
+            place = join_waitlist(student.id, course_id)
+        except IntegrityError:
+            if db.session.execute(db.select(Course.id).where(Course.id == course_id)).first() is None:
+                abort(404) # deleted while we were joining
+            raise
+        if place is None:
+            flash('You are already on the waitlist for this course.')
+        else:
+            flash(f'You are number {place} on the waitlist.')
+    return redirect(url_for('all_courses', student_id=student.id))
 
 
 # Student: Drop Course
 @app.route('/drop_course/<int:course_id>', methods=['POST'])
+@login_required
+@retry_on_lock
 def drop_course(course_id):
     
-    # Get course by ID
-    course = Course.query.get(course_id)
+    # The logged in student
+    student = loadstudent()
     
-    # Get student name from request form
-    name = request.form['name']
-    
-    # Load student by name
-    student = loadstudent(name)
-    
-    # Check if the student is enrolled in the course
-    enrolled = Enrollment.query.filter_by(student=student, course=course).first()
+    # Check if the student is enrolled in the course (unique_enrollment index)
+    enrolled = Enrollment.query.filter_by(student_id=student.id, course_id=course_id).first()
     if enrolled:
-        db.session.delete(enrolled)
+        db.session.delete(enrolled) # gives the seat back
+        db.session.flush()
+        promote_waitlist(course_id) # and hands it to the next student waiting, in the same transaction
         db.session.commit()
-        return redirect(url_for('student_view', name=name))
+        return redirect(url_for('student_view', student_id=student.id))
     else:
         flash('You are not enrolled in this course.')
-        return redirect(url_for('student_view', name=name))
+        return redirect(url_for('student_view', student_id=student.id))
+
+
+# Student: Transcript, grades of every term; archived terms are read from the archive database
+@app.route('/transcript/<int:student_id>')
+@read_only
+@login_required
+def transcript(student_id):
+
+    # The logged in student, 403 for anyone else
+    student = loadstudent(student_id)
+
+    # Terms still in the working tables, in one query
+    rows = db.session.execute(
+        db.select(Term.id.label('term_id'), Term.name.label('termName'), Course.courseName,
+                  Teacher.teacherName, Enrollment.grade)
+        .select_from(Enrollment)
+        .join(Course, Course.id == Enrollment.course_id)
+        .outerjoin(Term, Term.id == Course.term_id)
+        .outerjoin(Teacher, Teacher.id == Course.teacher_id)
+        .where(Enrollment.student_id == student.id)
+    ).all()
+
+    # plus the archived ones, oldest term first
+    rows += archived_transcript(student.id)
+    rows.sort(key=lambda row: (row.term_id or 0, row.courseName))
+
+    return render_template('transcript.html', student=student, rows=rows, current_user=student)
 
 
 # ----------------------------------------------------------------------------- #
 # Teacher: View
 @app.route('/teacher/<int:teacher_id>')
+@read_only
 def teacher_view(teacher_id):
     check = session.get('teacher', None)
 
@@ -528,17 +2230,84 @@ def teacher_view(teacher_id):
         flash('You do not have access to this page.')
         return abort(403) # Abort the request with a 403 Forbidden error
 
-    # Get teacher by ID
-    teacher = Teacher.query.get(teacher_id)  
+    # Get teacher by ID, the logged in teacher is already loaded
+    if isinstance(current_user, Teacher) and current_user.id == teacher_id:
+        teacher = current_user
+    else:
+        teacher = Teacher.query.get(teacher_id)
+    
+    # Rows for the courses they teach this term, from the fragment cache
+    term_id = requested_term_id()
+    course_rows = cached_fragment(teacher_fragment_key(teacher.id, term_id), lambda: render_teacher_courses(teacher, term_id))
     
-    # Retrieve courses they teach
-    courses = teacher.courses
+    # Grade statistics for each course, from the precomputed summaries
+    grade_stats = teacher_grade_stats(teacher.id, term_id)
     
     # Render info in teacher html
-    return render_template('teacher.html', teacher=teacher, courses=courses)
+    return render_template('teacher.html', teacher=teacher, course_rows=course_rows, grade_stats=grade_stats)
+
+
+# Average, spread, median and histogram per course from CourseGradeStats/CourseGradeBucket,
+# two queries and O(courses) work however many students are enrolled
+def teacher_grade_stats(teacher_id, term_id):
+    rows = db.session.execute(
+        db.select(Course.id, Course.courseName, CourseGradeStats.count, CourseGradeStats.total,
+                  CourseGradeStats.total_sq, CourseGradeStats.min_grade, CourseGradeStats.max_grade)
+        .join(CourseGradeStats, CourseGradeStats.course_id == Course.id)
+        .where(Course.teacher_id == teacher_id, Course.term_id == term_id, CourseGradeStats.count > 0)
+        .order_by(Course.courseName, Course.id)
+    ).all()
+    histograms = {row.id: [0] * GRADE_BUCKETS for row in rows}
+    for course_id, bucket, count in db.session.execute(
+        db.select(CourseGradeBucket.course_id, CourseGradeBucket.bucket, CourseGradeBucket.count)
+        .join(Course, Course.id == CourseGradeBucket.course_id)
+        .where(Course.teacher_id == teacher_id, Course.term_id == term_id)
+    ):
+        if course_id in histograms:
+            histograms[course_id][bucket] = count
+
+    grade_stats = []
+    for row in rows:
+        mean = row.total / row.count
+        histogram = histograms[row.id]
+        grade_stats.append({
+            "courseName": row.courseName,
+            "count": row.count,
+            "mean": mean,
+            "stdev": max(row.total_sq / row.count - mean * mean, 0.0) ** 0.5,
+            "median": histogram_median(histogram, row.count, row.min_grade, row.max_grade),
+            "min": row.min_grade,
+            "max": row.max_grade,
+            "histogram": histogram,
+        })
+    return grade_stats
+
+
+def histogram_median(histogram, count, low, high):
+    # estimated by interpolating inside the 10 point bucket that holds the middle grade
+    seen = 0
+    for bucket, bucket_count in enumerate(histogram):
+        if bucket_count and seen + bucket_count >= count / 2:
+            start = max(bucket * 10, low)
+            end = min(100 if bucket == GRADE_BUCKETS - 1 else (bucket + 1) * 10, high)
+            return start + (end - start) * (count / 2 - seen) / bucket_count
+        seen += bucket_count
+    return None
+
+
+# Rendered <tr> rows of a teacher's courses in a term, from one query
+def render_teacher_courses(teacher, term_id):
+    courses = db.session.execute(
+        db.select(Course.id, Course.courseName, Course.time, Course.capacity, Course.enrolled_count)
+        .where(Course.teacher_id == teacher.id, Course.term_id == term_id)
+        .order_by(Course.courseName, Course.id)
+    ).all()
+    teacher_course_row = get_template_attribute('fragments.html', 'teacher_course_row')
+    return ''.join(str(teacher_course_row(course, teacher)) for course in courses)
 
 # Teacher: Display all Enrollments
 @app.route('/teacher/course/<int:course_id>')
+@read_only
 def teacher_all(course_id):
     check = session.get('teacher', None)
 
@@ -549,8 +2318,13 @@ def teacher_all(course_id):
     # Get course by ID
     course = Course.query.get(course_id)
     
-    # Retrieve all students enrolled in the course
-    enrollments = Enrollment.query.filter_by(course_id=course.id).all()  
+    # Retrieve all students enrolled in the course, with their names, in one query
+    enrollments = db.session.execute(
+        db.select(Enrollment.student_id, Enrollment.grade, User.studentName)
+        .join(User, User.id == Enrollment.student_id)
+        .where(Enrollment.course_id == course.id)
+        .order_by(User.studentName)
+    ).all()
     
     # Retrieve teacher associated with the course
     teacher = course.teacher
@@ -558,29 +2332,185 @@ def teacher_all(course_id):
     # Render information on teacherall html
     return render_template('teacherall.html', course=course, enrollments=enrollments, teacher=teacher)
 
-# Teacher: Edit Grades
+# Course taught by the logged in teacher, 403 for anyone else
+def teacher_course(course_id):
+    if session.get('teacher', None) != True or not isinstance(current_user, Teacher):
+        abort(403)
+    course = db.session.get(Course, course_id)
+    if course is None:
+        abort(404)
+    if course.teacher_id != current_user.id:
+        abort(403)
+    return course
+
+
+# Bulk grade update: every row is checked first (0-100, enrolled in the course, listed once), then
+# all good rows go out as one executemany UPDATE keyed on (course_id, student_id) in a single
+# transaction. Bad rows are reported back instead of failing the whole roster.
+def apply_grades(course_id, rows):
+    enrolled = dict(db.session.execute(
+        db.select(Enrollment.student_id, Enrollment.grade).where(Enrollment.course_id == course_id)
+    ).all())
+
+    updates, errors, seen = [], [], set()
+    for number, row in enumerate(rows, start=1):
+        try:
+            student_id = int(row['student_id'])
+            grade = float(row['grade'])
+        except (KeyError, TypeError, ValueError):
+            errors.append({"row": number, "error": "student_id and a numeric grade are required"})
+            continue
+        if not 0.0 <= grade <= 100.0: # same bounds as grade_range_check
+            errors.append({"row": number, "student_id": student_id, "error": "grade must be between 0 and 100"})
+        elif student_id not in enrolled:
+            errors.append({"row": number, "student_id": student_id, "error": "student is not enrolled in this course"})
+        elif student_id in seen:
+            errors.append({"row": number, "student_id": student_id, "error": "student is listed more than once"})
+        else:
+            seen.add(student_id)
+            updates.append({"b_course": course_id, "b_student": student_id, "b_grade": grade})
+
+    if updates:
+        table = Enrollment.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.course_id == bindparam('b_course'), table.c.student_id == bindparam('b_student'))
+            .values(grade=bindparam('b_grade')),
+            updates,
+        )
+        apply_grade_changes(db.session.connection(), {course_id: (
+            [enrolled[update["b_student"]] for update in updates], [update["b_grade"] for update in updates])})
+    db.session.commit()
+    return len(updates), errors
+
+
+# Teacher: Bulk grades, JSON [{"student_id": 1, "grade": 90}, ...] or CSV with a student_id,grade header
+@app.route('/api/courses/<int:course_id>/grades', methods=['POST'])
+@login_required
+@retry_on_lock
+def bulk_grades(course_id):
+    course = teacher_course(course_id)
+
+    if request.mimetype == 'text/csv':
+        rows = list(csv.DictReader(io.StringIO(request.get_data(as_text=True))))
+    else:
+        rows = request.get_json(silent=True)
+        if isinstance(rows, dict):
+            rows = rows.get('grades')
+        if not isinstance(rows, list):
+            return jsonify({"error": "Expected a list of grades"}), 400
+
+    updated, errors = apply_grades(course.id, rows)
+    return jsonify({"updated": updated, "errors": errors}), 200 if not errors else 207
+
+
+# Teacher: Edit Grades (the roster form posts every grade_<student_id> field at once)
 @app.route('/edit_grades', methods=['POST'])
+@login_required
+@retry_on_lock
 def edit_grades():
     
-    # Get course ID via form
-    course_id = request.form.get('course_id')
-    
-    # Get course by ID
-    course = Course.query.get(course_id)
+    # Get course by ID via form
+    course = teacher_course(request.form.get('course_id', type=int))
 
-    # Edit grades   based on form data
-    for enrollment in course.enrollments:
-        student_id = enrollment.student.id
-        new_grade = request.form.get(f'grade_{student_id}')
-        
-        if new_grade is not None:  # Check if a grade is provided
-            enrollment.grade = new_grade
+    # Collect grades from the form data
+    rows = [{"student_id": key[len('grade_'):], "grade": value}
+            for key, value in request.form.items() if key.startswith('grade_')]
 
-    # Commit changes to database
-    db.session.commit()
+    # Save them in one statement
+    updated, errors = apply_grades(course.id, rows)
+    for error in errors:
+        flash(f"Row {error['row']}: {error['error']}")
 
     # Redirect to teacher_all
-    return redirect(url_for('teacher_all', course_id=course_id))
+    return redirect(url_for('teacher_all', course_id=course.id))
+
+
+# ----------------------------------------------------------------------------- #
+# Roster / gradebook export: rows stream from a server-side cursor (yield_per) straight into the
+# response as CSV or JSONL, one batch at a time, so memory stays flat whatever the roster size.
+EXPORT_BATCH = 1000
+
+def roster_query():
+    return (
+        db.select(Course.id.label('course_id'), Course.courseName, Course.time,
+                  User.id.label('student_id'), User.studentName, User.email, Enrollment.grade)
+        .join(Enrollment, Enrollment.course_id == Course.id)
+        .join(User, User.id == Enrollment.student_id)
+        .order_by(Enrollment.course_id, Enrollment.student_id)
+        .execution_options(yield_per=EXPORT_BATCH)
+    )
+
+
+def export_response(query, filename):
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        abort(400)
+    compress = request.args.get('gzip') == '1'
+
+    def generate():
+        g.read_only = True # the rows are read after the view returns, so route them here
+        try:
+            yield from write_rows(db.session.execute(query))
+        finally:
+            g.read_only = False
+
+    def write_rows(result):
+        columns = list(result.keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == 'csv':
+            writer.writerow(columns)
+        for batch in result.partitions():
+            for row in batch:
+                if fmt == 'csv':
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(zip(columns, row))) + '\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def gzipped(chunks):
+        compressor = zlib.compressobj(wbits=31) # gzip container
+        for chunk in chunks:
+            yield compressor.compress(chunk.encode())
+        yield compressor.flush()
+
+    body = stream_with_context(generate())
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"{filename}.{fmt}"
+    if compress:
+        body, mimetype, filename = gzipped(body), 'application/gzip', filename + '.gz'
+    return Response(body, mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+# Teacher: Export one course roster
+@app.route('/teacher/course/<int:course_id>/export')
+@login_required
+def export_course(course_id):
+    course = teacher_course(course_id)
+    return export_response(roster_query().where(Course.id == course.id), f"course_{course.id}")
+
+
+# Teacher: Export all of their courses
+@app.route('/teacher/<int:teacher_id>/export')
+@login_required
+def export_teacher(teacher_id):
+    if session.get('teacher', None) != True or current_user.id != teacher_id:
+        abort(403)
+    return export_response(roster_query().where(Course.teacher_id == teacher_id), f"teacher_{teacher_id}")
+
+
+# Admin: Export every enrollment
+@app.route('/admin_export')
+@login_required
+def export_all():
+    if session.get('role') != 'admin' or current_user.role != 'admin':
+        abort(403)
+    return export_response(roster_query(), "enrollments")
 
 
 # these are the old portals, they are just here for reference
@@ -609,13 +2539,652 @@ def edit_grades():
 
 
 
+# Admin: fragment cache counters
+@app.route('/cache_stats')
+@login_required
+def cache_stats():
+    if session.get('role') != 'admin' or current_user.role != 'admin':
+        abort(403)
+    return jsonify(fragment_cache.stats())
+
+
+#  ------------------------------------------------------------------------------------------  #
+# Schema migrations: PRAGMA user_version holds the number of the last step applied, and
+# `flask migrate` runs the newer steps in order, each in its own transaction. SQLite commits some DDL
+# on its own, so every step is written to be safe to run again after a failure.
+def add_missing_columns(connection):
+    inspector = db.inspect(connection)
+    tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        have = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in have:
+                continue
+            ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(connection.dialect)}'
+            if column.server_default is not None:
+                ddl += f" DEFAULT '{column.server_default.arg}'"
+            elif column.default is not None and column.default.is_scalar:
+                ddl += f" DEFAULT {db.literal(column.default.arg).compile(compile_kwargs={'literal_binds': True})}"
+            elif not column.nullable:
+                ddl += " DEFAULT ''" # SQLite needs a default for NOT NULL, the step fills in real values
+            if not column.nullable:
+                ddl += " NOT NULL"
+            connection.exec_driver_sql(ddl)
+
+
+def migrate_tables(connection):
+    # tables the models gained, columns added since a table was first created, and their values
+    db.metadata.create_all(connection)
+    add_missing_columns(connection)
+    connection.execute(User.__table__.update().where(User.studentName == '').values(
+        studentName=db.func.substr(User.email, 1, db.func.instr(User.email, '@') - 1)))
+    connection.execute(User.__table__.update().where(User.role.is_(None)).values(role='student'))
+    courses = connection.execute(
+        db.select(Course.id, Course.time).where(Course.start_min.is_(None), Course.days_mask == 0)).all()
+    meetings = [dict(zip(("b_mask", "b_start", "b_end"), parse_meeting_time(time)), b_id=id) for id, time in courses]
+    if meetings:
+        table = Course.__table__
+        connection.execute(table.update().where(table.c.id == bindparam('b_id'))
+                           .values(days_mask=bindparam('b_mask'), start_min=bindparam('b_start'), end_min=bindparam('b_end')),
+                           meetings)
+
+
+def ensure_unique(connection, table, columns, name):
+    # keep the oldest row of each duplicate group, then add the unique index if the table lacks one
+    keep = db.select(db.func.min(table.c.id)).group_by(*[table.c[column] for column in columns])
+    connection.execute(table.delete().where(table.c.id.not_in(keep)))
+    inspector = db.inspect(connection)
+    existing = [unique["column_names"] for unique in inspector.get_unique_constraints(table.name)]
+    existing += [index["column_names"] for index in inspector.get_indexes(table.name) if index["unique"]]
+    if list(columns) not in existing:
+        index = Index(name, *[table.c[column] for column in columns], unique=True)
+        index.create(connection)
+        table.indexes.discard(index) # the model already declares the constraint, keep it off the metadata
+
+
+def dedupe_enrollments(connection):
+    ensure_unique(connection, Enrollment.__table__, ('student_id', 'course_id'), 'unique_enrollment')
+    ensure_unique(connection, Waitlist.__table__, ('course_id', 'student_id'), 'unique_waitlist')
+
+
+def create_model_indexes(connection):
+    # every index declared on the models; one whose columns changed is dropped and rebuilt
+    inspector = db.inspect(connection)
+    for table in db.metadata.sorted_tables:
+        existing = {index["name"]: index["column_names"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing and existing[index.name] != [column.name for column in index.columns]:
+                index.drop(connection)
+            index.create(connection, checkfirst=True)
+
+
+def rebuild_course_totals(connection):
+    repair_course_totals() # commits
+
+
+def rebuild_foreign_keys(connection):
+    # ON DELETE CASCADE / SET NULL, course.teacher_id nullable.
+    # foreign_keys=OFF only takes effect outside a transaction, and nothing has written yet here.
+    connection.exec_driver_sql("PRAGMA foreign_keys = OFF")
+    enrollment, waitlist, course = Enrollment.__table__, Waitlist.__table__, Course.__table__
+    students, courses = db.select(User.__table__.c.id), db.select(course.c.id)
+    connection.execute(course.update().where(course.c.teacher_id.not_in(db.select(Teacher.__table__.c.id)))
+                       .values(teacher_id=None))
+    for table in (enrollment, waitlist):
+        connection.execute(table.delete().where(
+            db.or_(table.c.student_id.not_in(students), table.c.course_id.not_in(courses))))
+    for table in (CourseGradeStats.__table__, CourseGradeBucket.__table__):
+        connection.execute(table.delete().where(table.c.course_id.not_in(courses)))
+    rebuild_tables(connection, (course, enrollment, waitlist, CourseGradeStats.__table__, CourseGradeBucket.__table__))
+
+
+def rebuild_tables(connection, tables):
+    # SQLite cannot change a foreign key in place: copy each table into one created from the model,
+    # swap it in, then put the indexes back. Dropping a table with foreign keys on would cascade.
+    if connection.exec_driver_sql("PRAGMA foreign_keys").scalar():
+        raise click.ClickException("foreign keys are still on, the step must turn them off before writing")
+    scratch = db.MetaData()
+    for table in db.metadata.sorted_tables:
+        table.to_metadata(scratch) # so the copies' foreign keys resolve
+    for table in tables:
+        copy = table.to_metadata(scratch, name=f"{table.name}_rebuild")
+        copy.indexes.clear()
+        connection.execute(db.schema.CreateTable(copy))
+        have = {column["name"] for column in db.inspect(connection).get_columns(table.name)}
+        columns = ", ".join(f'"{column.name}"' for column in table.columns if column.name in have)
+        connection.exec_driver_sql(f'INSERT INTO "{copy.name}" ({columns}) SELECT {columns} FROM "{table.name}"')
+        connection.exec_driver_sql(f'DROP TABLE "{table.name}"')
+        connection.exec_driver_sql(f'ALTER TABLE "{copy.name}" RENAME TO "{table.name}"')
+    create_model_indexes(connection)
+    problems = connection.exec_driver_sql("PRAGMA foreign_key_check").all()
+    if problems:
+        raise click.ClickException(f"foreign key check failed after the rebuild: {problems[:5]}")
+
+
+def add_terms(connection):
+    connection.exec_driver_sql("PRAGMA foreign_keys = OFF") # before anything writes, see rebuild_foreign_keys
+    term = Term.__table__
+    term.create(connection, checkfirst=True)
+    add_missing_columns(connection)
+    if connection.execute(db.select(term.c.id).limit(1)).first() is None:
+        connection.execute(term.insert().values(name="Current", active=True))
+    active = db.select(term.c.id).where(term.c.active).order_by(term.c.id.desc()).limit(1).scalar_subquery()
+    connection.execute(Course.__table__.update().where(Course.term_id.is_(None)).values(term_id=active))
+    rebuild_tables(connection, [Course.__table__]) # for the term_id foreign key and the term-scoped indexes
+    forget_active_term()
+
+
+MIGRATIONS = [
+    (1, "add missing tables and columns", migrate_tables),
+    (2, "drop duplicate enrollments, one per student and course", dedupe_enrollments),
+    (3, "create the indexes for the hot query paths", create_model_indexes),
+    (4, "rebuild seat counters and grade statistics", rebuild_course_totals),
+    (5, "create the NOCASE indexes for admin search", create_model_indexes),
+    (6, "create the NOCASE indexes for the teacher picker", create_model_indexes),
+    (7, "rebuild tables with ON DELETE CASCADE / SET NULL foreign keys", rebuild_foreign_keys),
+    (8, "add terms, existing courses go into one active term", add_terms),
+]
+
+
+def schema_version():
+    return db.session.execute(db.text("PRAGMA user_version")).scalar()
+
+
+def run_migrations():
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version <= schema_version():
+            continue
+        step(db.session.connection())
+        db.session.execute(db.text(f"PRAGMA user_version = {version}"))
+        db.session.commit()
+        db.session.connection().exec_driver_sql("PRAGMA foreign_keys = ON") # a step may have switched them off
+        applied.append((version, description))
+    return applied
+
+
+@app.cli.command('migrate')
+@click.option('--status', is_flag=True, help='Only show the schema version and pending steps.')
+def migrate_command(status):
+    if db.engine.url.get_backend_name() != "sqlite":
+        raise click.ClickException("migrations track their version with PRAGMA user_version, SQLite only")
+    if status:
+        current = schema_version()
+        print(f"schema version {current} of {MIGRATIONS[-1][0]}")
+        for version, description, step in MIGRATIONS:
+            if version > current:
+                print(f"  pending {version}: {description}")
+        return
+    for version, description in run_migrations():
+        print(f"applied {version}: {description}")
+    print(f"schema version {schema_version()}")
+
+
+# Creates any index declared on the models that an existing database is missing
+@app.cli.command('create-indexes')
+def create_indexes_command():
+    create_model_indexes(db.session.connection())
+    db.session.commit()
+    print("Indexes created.")
+
+
+# Representative queries of the hot routes, each expected to reach its rows through an index; where a
+# route has its own query builder, the real statement. `flask check-query-plans` runs EXPLAIN QUERY PLAN
+# on them and fails on any full table or index scan, and on a meeting-time range over the catalog taken
+# before the student's enrollments (a cost that grows with the catalog instead of their schedule).
+def hot_queries():
+    roster = db.aliased(User)
+    return {
+        "login: student by email": db.select(User.id, User.password).where(User.email == 'student@example.edu'),
+        "login: teacher by email": db.select(Teacher.id, Teacher.password).where(Teacher.email == 'teacher@EDUteacher.org'),
+        "catalog page": db.select(Course.id, Course.courseName).where(Course.term_id == 1, Course.courseName >= 'CSE')
+                        .order_by(Course.courseName, Course.id).limit(COURSE_PAGE_SIZE),
+        "student enrollments": db.select(Enrollment.course_id).where(Enrollment.student_id == 1),
+        "student dashboard": student_courses_query(1, 1),
+        "already enrolled": db.select(Enrollment.id).where(Enrollment.student_id == 1, Enrollment.course_id == 1),
+        "teacher courses": db.select(Course.id, Course.courseName).where(Course.teacher_id == 1, Course.term_id == 1),
+        "course roster": db.select(Enrollment.student_id, Enrollment.grade, roster.studentName)
+                         .join(roster, roster.id == Enrollment.student_id).where(Enrollment.course_id == 1),
+        "add course: schedule conflict": schedule_conflict_query(1, 1),
+        "catalog: conflicting courses": conflicting_courses_query(1),
+        "checkout: schedule clashes": schedule_clashes_query(1, [1, 2, 3]),
+        "waitlist head": db.select(Waitlist.id).where(Waitlist.course_id == 1).order_by(Waitlist.position).limit(1),
+        "grade range": db.select(db.func.min(Enrollment.grade)).where(Enrollment.course_id == 1),
+        "admin student search": db.select(User.id).where(User.studentName.like('ann%')),
+        "admin email search": db.select(User.id).where(User.email.like('ann%')),
+        "admin course search": db.select(Course.id).where(Course.courseName.like('cse 1%')),
+        "admin teacher picker": db.select(Teacher.id).where(
+            db.or_(Teacher.teacherName.like('ann%'), Teacher.email.like('ann%'))).limit(20),
+    }
+
+
+def query_plan(connection, query):
+    sql = str(query.compile(connection, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def plan_problems(plan):
+    # whole table or index scans, and an ix_course_meeting range walked before enrollment is reached
+    problems = [step for step in plan if step.startswith("SCAN")]
+    tables = [step.split()[1] if step.startswith("SEARCH") else None for step in plan]
+    meeting = [n for n, step in enumerate(plan) if "ix_course_meeting" in step]
+    if meeting and "enrollment" in tables and meeting[0] < tables.index("enrollment"):
+        problems.append(plan[meeting[0]])
+    return problems
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    connection = db.session.connection()
+    failures = 0
+    for name, query in hot_queries().items():
+        try:
+            plan = query_plan(connection, query)
+        except OperationalError as error: # e.g. a table the migrations have not created yet
+            plan = [f"SCAN (not runnable: {error.orig})"]
+        problems = plan_problems(plan)
+        failures += bool(problems)
+        print(f"{'FAIL' if problems else 'ok  '} {name}")
+        for step in plan:
+            print(f"  {'>>' if step in problems else '  '}   {step}")
+    if failures:
+        raise click.ClickException(f"{failures} hot queries have a bad plan; for missing indexes run `flask migrate`")
+
+
+# Mixed read/write load against a scratch copy of the schema, once per database profile
+@app.cli.command('db-benchmark')
+@click.option('--seconds', default=5.0, help='How long to run each profile.')
+@click.option('--readers', default=8, help='Threads browsing the catalog.')
+@click.option('--writers', default=2, help='Threads adding and dropping enrollments.')
+def db_benchmark(seconds, readers, writers):
+    catalog = (
+        db.select(Course.id, Course.courseName, Course.enrolled_count, Teacher.teacherName)
+        .join(Teacher, Course.teacher_id == Teacher.id)
+    )
+    enrollment = Enrollment.__table__
+
+    for profile in DB_PROFILES:
+        with tempfile.TemporaryDirectory() as scratch:
+            url = f"sqlite:///{os.path.join(scratch, 'bench.sqlite')}"
+            engine = create_engine(url, **engine_options(url, app.config))
+            event.listen(engine, "connect", lambda connection, record, profile=profile: apply_pragmas(connection, profile))
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(Teacher.__table__.insert(), [{"teacherName": "T", "email": "t@EDUteacher.org", "password": "x"}])
+                connection.execute(Course.__table__.insert(), [
+                    {"courseName": f"CSE {n}", "time": "MWF 9:00-9:50 AM", "capacity": 10 ** 6, "teacher_id": 1}
+                    for n in range(200)])
+                connection.execute(User.__table__.insert(), [
+                    {"studentName": f"s{n}", "email": f"s{n}@bench", "password": "x"} for n in range(1000)])
+
+            counts = {"reads": 0, "writes": 0, "locked": 0}
+            counts_lock = threading.Lock()
+            deadline = time.perf_counter() + seconds
+
+            def work(write):
+                done = locked = 0
+                while time.perf_counter() < deadline:
+                    try:
+                        with engine.begin() as connection:
+                            if write:
+                                row = {"student_id": random.randint(1, 1000), "course_id": random.randint(1, 200)}
+                                connection.execute(enrollment.delete().where(
+                                    enrollment.c.student_id == row["student_id"], enrollment.c.course_id == row["course_id"]))
+                                connection.execute(enrollment.insert(), [row])
+                            else:
+                                connection.execute(catalog).all()
+                        done += 1
+                    except OperationalError:
+                        locked += 1
+                with counts_lock:
+                    counts["writes" if write else "reads"] += done
+                    counts["locked"] += locked
+
+            threads = [threading.Thread(target=work, args=(n < writers,)) for n in range(readers + writers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            engine.dispose()
+
+        print(f"{profile:12} {counts['reads'] / seconds:10.1f} reads/s {counts['writes'] / seconds:10.1f} writes/s "
+              f"{counts['locked']} locked errors")
+
+
+@app.cli.command('repair-grade-stats')
+def repair_grade_stats_command():
+    refresh_grade_stats(db.session.connection())
+    db.session.commit()
+    print("Grade statistics rebuilt.")
+
+
+@app.cli.command('archive-terms')
+@click.option('--dry-run', is_flag=True, help='Only list the closed terms that would move.')
+@click.option('--vacuum', is_flag=True, help='VACUUM the database afterwards to give the space back.')
+def archive_terms_command(dry_run, vacuum):
+    if db.engine.url.get_backend_name() != "sqlite":
+        raise click.ClickException("the archive is an attached SQLite database, SQLite only")
+    terms = db.session.execute(
+        db.select(Term.id, Term.name).where(Term.closed, ~Term.active, ~Term.archived).order_by(Term.id)
+    ).all()
+    db.session.commit()
+    if dry_run or not terms:
+        for term in terms:
+            print(f"would archive {term.name}")
+        print(f"{len(terms)} closed terms to archive")
+        return
+    path = archive_path()
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql("ATTACH DATABASE ? AS archive", (path,))
+        try:
+            archive_metadata.create_all(connection)
+            connection.commit()
+            for term in terms:
+                courses, enrollments, stale = archive_term(connection, term.id)
+                connection.commit() # both files in one transaction
+                fragment_cache.delete(stale)
+                print(f"archived {term.name}: {courses} courses, {enrollments} enrollments")
+        finally:
+            connection.rollback()
+            connection.exec_driver_sql("DETACH DATABASE archive")
+    if vacuum:
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql("VACUUM")
+    print(f"archive: {path}")
+
+
+@app.cli.command('recount-seats')
+def recount_seats_command():
+    recount_seats()
+    print("Seat counters rebuilt.")
+
+
+# ----------------------------------------------------------------------------- #
+# Term archive: `flask archive-terms` ATTACHes the archive file as "archive" and, one closed term per
+# transaction, copies the term's courses (with the teacher's name) and enrollments there, then
+# deletes the courses, which takes their enrollments, waitlists and grade stats with them. The
+# working tables stay about one term big. Transcripts read the archive through a read-only engine.
+archive_metadata = db.MetaData(schema="archive")
+
+archived_terms = db.Table("term", archive_metadata,
+    db.Column("id", db.Integer, primary_key=True),
+    db.Column("name", db.String(20), nullable=False),
+)
+archived_courses = db.Table("course", archive_metadata,
+    db.Column("term_id", db.Integer, primary_key=True),
+    db.Column("id", db.Integer, primary_key=True), # Course.id at the time, ids may be reused later
+    db.Column("courseName", db.String(20), nullable=False),
+    db.Column("time", db.String(20), nullable=False),
+    db.Column("teacherName", db.String(30)),
+    db.Column("capacity", db.Integer, nullable=False),
+    db.Column("enrolled_count", db.Integer, nullable=False),
+)
+archived_enrollments = db.Table("enrollment", archive_metadata,
+    db.Column("term_id", db.Integer, primary_key=True),
+    db.Column("course_id", db.Integer, primary_key=True),
+    db.Column("student_id", db.Integer, primary_key=True),
+    db.Column("grade", db.Float, nullable=False),
+    Index("ix_archive_enrollment_student", "student_id"), # transcripts
+)
+
+_archive_engine = None
+
+def archive_path():
+    return app.config["ARCHIVE_DATABASE"] or os.path.join(os.path.dirname(db.engine.url.database), "archive.sqlite")
+
+
+def archive_engine():
+    # None until archive-terms has created the file
+    global _archive_engine
+    if _archive_engine is None:
+        path = archive_path()
+        if not os.path.exists(path):
+            return None
+        _archive_engine = create_engine(f"sqlite:///file:{path}?mode=ro&uri=true").execution_options(
+            schema_translate_map={"archive": None}) # the tables are not attached here, they are the main schema
+    return _archive_engine
+
+
+def archived_transcript(student_id):
+    engine = archive_engine()
+    if engine is None:
+        return []
+    enrollment, course, term = archived_enrollments, archived_courses, archived_terms
+    with engine.connect() as connection:
+        return connection.execute(
+            db.select(term.c.id.label('term_id'), term.c.name.label('termName'), course.c.courseName,
+                      course.c.teacherName, enrollment.c.grade)
+            .select_from(enrollment)
+            .join(course, (course.c.term_id == enrollment.c.term_id) & (course.c.id == enrollment.c.course_id))
+            .join(term, term.c.id == enrollment.c.term_id)
+            .where(enrollment.c.student_id == student_id)
+        ).all()
+
+
+def archive_term(connection, term_id):
+    # returns (courses, enrollments, fragment keys to drop)
+    course, enrollment, teacher, term = Course.__table__, Enrollment.__table__, Teacher.__table__, Term.__table__
+    in_term = course.c.term_id == term_id
+    stale = {catalog_fragment_key(term_id)}
+    stale.update(teacher_fragment_key(teacher_id, term_id) for teacher_id in connection.execute(
+        db.select(course.c.teacher_id).distinct().where(in_term, course.c.teacher_id.is_not(None))).scalars())
+
+    connection.execute(archived_terms.insert().prefix_with("OR REPLACE").from_select(
+        ['id', 'name'], db.select(term.c.id, term.c.name).where(term.c.id == term_id)))
+    courses = connection.execute(archived_courses.insert().from_select(
+        ['term_id', 'id', 'courseName', 'time', 'teacherName', 'capacity', 'enrolled_count'],
+        db.select(course.c.term_id, course.c.id, course.c.courseName, course.c.time, teacher.c.teacherName,
+                  course.c.capacity, course.c.enrolled_count)
+        .select_from(course).outerjoin(teacher, teacher.c.id == course.c.teacher_id).where(in_term))).rowcount
+    enrollments = connection.execute(archived_enrollments.insert().from_select(
+        ['term_id', 'course_id', 'student_id', 'grade'],
+        db.select(course.c.term_id, enrollment.c.course_id, enrollment.c.student_id, enrollment.c.grade)
+        .join(course, course.c.id == enrollment.c.course_id).where(in_term))).rowcount
+
+    connection.execute(course.delete().where(in_term)) # ON DELETE CASCADE clears the rest
+    connection.execute(term.update().where(term.c.id == term_id).values(archived=True))
+    return courses, enrollments, stale
+
+
+# ----------------------------------------------------------------------------- #
+# Bulk import: flask --app app import students|teachers|courses|enrollments FILE [--dry-run]
+# Files are CSV (with a header row) or JSONL. Rows are validated against in-memory indexes of
+# what is already in the database, passwords are hashed across a process pool, and each chunk
+# goes in as one executemany INSERT.
+import_cli = AppGroup('import', help='Bulk load students, teachers, courses and enrollments.')
+app.cli.add_command(import_cli)
+
+IMPORT_CHUNK = 5000
+
+def read_records(path):
+    with open(path, newline='') as file:
+        if path.endswith('.jsonl'):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+
+def chunked(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_import(path, table, prepare, chunk_size, dry_run, finish=None):
+    # prepare(records, first_row, errors) -> rows ready for INSERT
+    start = time.perf_counter()
+    read = inserted = 0
+    errors = []
+    for records in chunked(read_records(path), chunk_size):
+        rows = prepare(records, read + 1, errors)
+        read += len(records)
+        if rows and not dry_run:
+            db.session.execute(table.insert(), rows)
+            db.session.commit()
+        inserted += len(rows)
+    if finish is not None and not dry_run:
+        finish()
+
+    elapsed = time.perf_counter() - start
+    for row, message in errors[:20]:
+        print(f"row {row}: {message}")
+    if len(errors) > 20:
+        print(f"... and {len(errors) - 20} more errors")
+    print(f"{'validated' if dry_run else 'inserted'} {inserted} of {read} rows, {len(errors)} rejected, "
+          f"{elapsed:.2f}s ({read / elapsed if elapsed else 0:.0f} rows/s)")
+
+
+def account_importer(model, name_column, email_check, dry_run, pool):
+    known = set(db.session.execute(db.select(model.email)).scalars())
+
+    def prepare(records, first_row, errors):
+        accepted = []
+        for row, record in enumerate(records, start=first_row):
+            name, email, password = record.get('name'), record.get('email'), record.get('password')
+            if not (name and email and password):
+                errors.append((row, "name, email and password are required"))
+            elif email in known:
+                errors.append((row, f"email {email} already exists"))
+            elif not email_check(email):
+                errors.append((row, f"email {email} has the wrong handle"))
+            else:
+                known.add(email)
+                accepted.append({name_column: name, "email": email, "password": password})
+        if accepted and not dry_run:
+            method = app.config["PASSWORD_HASH_METHOD"]
+            hashes = pool.map(generate_password_hash, [row["password"] for row in accepted],
+                              [method] * len(accepted), chunksize=64)
+            for row, hashed in zip(accepted, hashes):
+                row["password"] = hashed
+        return accepted
+
+    return prepare
+
+
+import_options = [
+    click.argument('path', type=click.Path(exists=True, dir_okay=False)),
+    click.option('--dry-run', is_flag=True, help='Validate only, write nothing.'),
+    click.option('--chunk-size', default=IMPORT_CHUNK, show_default=True),
+]
+
+def import_command(func):
+    for option in reversed(import_options):
+        func = option(func)
+    return import_cli.command(func.__name__)(func)
+
+
+@import_command
+def students(path, dry_run, chunk_size):
+    # columns: name, email, password
+    with ProcessPoolExecutor(max_workers=app.config["PASSWORD_HASH_WORKERS"] or 1, mp_context=HASH_POOL_CONTEXT) as pool:
+        prepare = account_importer(User, "studentName", lambda email: not email.endswith("@EDUteacher.org"), dry_run, pool)
+        run_import(path, User.__table__, prepare, chunk_size, dry_run)
+
+
+@import_command
+def teachers(path, dry_run, chunk_size):
+    # columns: name, email, password
+    with ProcessPoolExecutor(max_workers=app.config["PASSWORD_HASH_WORKERS"] or 1, mp_context=HASH_POOL_CONTEXT) as pool:
+        prepare = account_importer(Teacher, "teacherName", lambda email: email.endswith("@EDUteacher.org"), dry_run, pool)
+        run_import(path, Teacher.__table__, prepare, chunk_size, dry_run)
+
+
+@import_command
+def courses(path, dry_run, chunk_size):
+    # columns: courseName, time, capacity, teacher_email, term (optional, the active term by default)
+    teacher_ids = dict(db.session.execute(db.select(Teacher.email, Teacher.id)).all())
+    term_ids = dict(db.session.execute(db.select(Term.name, Term.id)).all())
+    active = active_term_id()
+
+    def prepare(records, first_row, errors):
+        accepted = []
+        for row, record in enumerate(records, start=first_row):
+            try:
+                capacity = int(record['capacity'])
+                days_mask, start_min, end_min = parse_meeting_time(record['time'])
+                teacher_id = teacher_ids[record['teacher_email']]
+                term_id = term_ids[record['term']] if record.get('term') else active
+            except KeyError as missing:
+                errors.append((row, f"unknown or missing {missing}"))
+                continue
+            except (TypeError, ValueError) as error:
+                errors.append((row, str(error)))
+                continue
+            if not record.get('courseName') or capacity < 0:
+                errors.append((row, "courseName and a capacity of 0 or more are required"))
+                continue
+            accepted.append({"courseName": record['courseName'], "time": record['time'], "capacity": capacity,
+                             "teacher_id": teacher_id, "term_id": term_id, "days_mask": days_mask,
+                             "start_min": start_min, "end_min": end_min})
+        return accepted
+
+    run_import(path, Course.__table__, prepare, chunk_size, dry_run, finish=drop_all_course_fragments)
+
+
+def repair_course_totals():
+    refresh_grade_stats(db.session.connection())
+    recount_seats() # commits
+
+
+def drop_all_course_fragments():
+    stale_course_fragments(db.session)
+    db.session.commit()
+
+
+@import_command
+def enrollments(path, dry_run, chunk_size):
+    # columns: student_email, course_id, grade (optional)
+    student_ids = dict(db.session.execute(db.select(User.email, User.id)).all())
+    seats = {row.id: [row.enrolled_count, row.capacity]
+             for row in db.session.execute(db.select(Course.id, Course.enrolled_count, Course.capacity))}
+    taken = set(db.session.execute(db.select(Enrollment.student_id, Enrollment.course_id)).tuples())
+
+    def prepare(records, first_row, errors):
+        accepted = []
+        for row, record in enumerate(records, start=first_row):
+            try:
+                student_id = student_ids[record['student_email']]
+                course_id = int(record['course_id'])
+                grade = float(record.get('grade') or 100.0)
+            except KeyError as missing:
+                errors.append((row, f"unknown or missing {missing}"))
+                continue
+            except (TypeError, ValueError) as error:
+                errors.append((row, str(error)))
+                continue
+            if course_id not in seats:
+                errors.append((row, f"unknown course_id {course_id}"))
+            elif (student_id, course_id) in taken:
+                errors.append((row, "already enrolled"))
+            elif seats[course_id][0] >= seats[course_id][1]:
+                errors.append((row, f"course {course_id} is full"))
+            elif not 0.0 <= grade <= 100.0:
+                errors.append((row, "grade must be between 0 and 100"))
+            else:
+                taken.add((student_id, course_id))
+                seats[course_id][0] += 1
+                accepted.append({"student_id": student_id, "course_id": course_id, "grade": grade})
+        return accepted
+
+    # plain INSERTs skip the seat-claiming and grade events, so rebuild counters and stats once at the end
+    run_import(path, Enrollment.__table__, prepare, chunk_size, dry_run, finish=repair_course_totals)
+
+
 @app.route('/logout')
 # @login_required
 def logout():
     logout_user()
     role = session.get('role', None)
-    print(f"---LOGOUT---Session Role: {role}")
-    print("-----Loged--out-------")
+    app.logger.debug("logged out, session role was %s", role)
 
     session['role'] = None
     session['email'] = None
@@ -647,6 +3216,16 @@ if __name__ == '__main__':
 # run this^ will install all thee right packages for this program
 
 
+### database settings
+# APP_DB_PROFILE=production   WAL journal + tuned pragmas for the registration rush
+# DATABASE_URL=sqlite:////srv/registration.sqlite   or any server database url
+# APP_SETTINGS=/path/to/settings.py   python file with any of the app.config keys
+# flask --app app db-benchmark   compares the profiles under mixed reads and writes
+# python bench.py   runs the route-level benchmark scenarios on a generated database (see bench.py)
+# APP_REPLICA_DATABASE_URL=...   read-only pages read from here (production profile defaults to a
+#                                mode=ro connection on the same WAL file)
+
+
 ### how to delete or create db. type into terminal
 #  flask shell
 # >>>
@@ -657,16 +3236,38 @@ if __name__ == '__main__':
 
 # flask --app app run   use this to run app
 
+# Course.enrolled_count was added for the enrollment engine, recreate the db (above) or run
+#  flask --app app recount-seats   to rebuild the seat counters from the enrollment table
+#  APP_LOG_LEVEL=INFO  logs one JSON line per request (route, status, ms, sql count/ms, template ms),
+#  APP_SLOW_QUERY_MS=50  adds the query plan of any statement slower than 50 ms, and
+#  /metrics serves the per-route histograms in the Prometheus text format, to admins only unless
+#  APP_METRICS_PUBLIC=true, which makes it public for a scraper that cannot log in
+#  flask --app app migrate  brings an existing database up to the models (columns, duplicate
+#  enrollments, indexes, counters); --status shows the pending steps
+#  flask --app app check-query-plans  asserts with EXPLAIN QUERY PLAN that the hot queries use indexes
+#  flask --app app create-indexes  to add the model indexes to an existing database
+#  flask --app app repair-grade-stats  to rebuild the per-course grade statistics
+#  flask --app app archive-terms  moves closed, inactive terms to archive.sqlite (ARCHIVE_DATABASE),
+#  add --vacuum to shrink the database file; terms are opened, activated and closed in the admin
+
+
+### bulk loading from CSV/JSONL files (add --dry-run to only validate)
+# flask --app app import students students.csv        name,email,password
+# flask --app app import teachers teachers.csv        name,email,password
+# flask --app app import courses courses.csv          courseName,time,capacity,teacher_email,term
+# flask --app app import enrollments enrollments.csv  student_email,course_id,grade
+
 
 ### how to add in to database using terminal.
-#>>> from app import app      use this to avoid error
-#>>> from app import db
-#>>> from app import User
+# (flask shell has the app context already; in a plain python shell enter it first)
+#>>> from app import app, db, User
+#>>> app.app_context().push()
 #>>> user1 = User(studentName="student1",email="somethin@gmail" ,password="something",role="student")
 #>>> db.session.add(user1)
 #>>> db.session.commit()
 
 
-# when in the database, if you have a student in enrollment db, or a teacher in Course db.
-# you have to delete first from where studen is in enrollement, then you can delete student,
-# you have to delete the course the teacher is teaching first before you delete teacher.
\ No newline at end of file
+# deleting a student (or a course) also deletes their enrollments and waitlist entries, and deleting
+# a teacher leaves their courses without a teacher. The admin list pages have bulk Delete actions
+# (and "Drop all enrollments" / "Clear enrollments") that do this in chunks of ADMIN_BULK_CHUNK rows.
+# Older databases need  flask --app app migrate  first so the foreign keys cascade.
\ No newline at end of file
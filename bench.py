@@ -0,0 +1,431 @@
+# Benchmark suite: builds a synthetic database from a seed, drives the real Flask routes through
+# the test client from several threads, and reports latency percentiles, throughput and SQL
+# statements per request for each scenario. Results can be saved as a baseline JSON and later
+# runs compared against it, exiting non-zero when a scenario regressed.
+#
+#  python bench.py                                   run every scenario at the default scale
+#  python bench.py --students 20000 --courses 800    bigger database
+#  python bench.py --scenario login_storm --threads 16 --requests 400
+#  python bench.py --save-baseline bench.json        record a baseline
+#  python bench.py --scenario dashboards --teachers 1 --students 10000 --per-student 1 --capacity 10000
+#                                                    dashboards with 10k enrollments for one teacher
+#  python bench.py --scenario seat_streams --streams 500
+#                                                    registration load with 500 live seat streams open
+#  python bench.py --user-sizes 1000,10000,100000     login_storm and dashboards at each User table size
+#  python bench.py --baseline bench.json             compare, exit 1 on a regression
+#
+# App settings go through the usual APP_* variables, e.g. APP_DB_PROFILE=production python bench.py
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+BENCH_PASSWORD = "bench-password"
+MEETING_TIMES = ["MWF 9:00-9:50 AM", "MWF 10:00-10:50 AM", "MWF 11:00-11:50 AM", "MWF 1:00-1:50 PM",
+                 "TR 9:30-10:45 AM", "TR 11:00-12:15 PM", "TR 1:30-2:45 PM", "TR 3:00-4:15 PM",
+                 "M 6:00-8:50 PM", "TBA"]
+SUBJECTS = ["CSE", "MATH", "PHYS", "CHEM", "BIO", "ECON", "HIST", "ENGR"]
+
+
+# Synthetic data: one password hash shared by every account (hashing each one would take minutes),
+# courses spread over the meeting slots, and a few enrollments per student within capacity.
+def generate(app_module, students, teachers, courses, per_student, seed, capacity=None):
+    db = app_module.db
+    rng = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+    password = app_module.hash_password(BENCH_PASSWORD)
+
+    teacher_rows = [{"id": n, "teacherName": f"Teacher {n}", "email": f"t{n}@EDUteacher.org",
+                     "password": password, "role": "teacher"} for n in range(1, teachers + 1)]
+    student_rows = [{"id": n, "studentName": f"Student {n}", "email": f"s{n}@bench.edu",
+                     "password": password, "role": "student"} for n in range(1, students + 1)]
+    term_rows = [{"id": 1, "name": "Bench", "active": True}]
+    course_rows = []
+    for n in range(1, courses + 1):
+        time_text = rng.choice(MEETING_TIMES)
+        mask, start, end = app_module.parse_meeting_time(time_text)
+        course_rows.append({"id": n, "courseName": f"{rng.choice(SUBJECTS)} {100 + n}", "time": time_text,
+                            "capacity": capacity or rng.choice([20, 40, 80, 150]), "teacher_id": rng.randint(1, teachers),
+                            "term_id": 1, "days_mask": mask, "start_min": start, "end_min": end})
+
+    seats = {row["id"]: row["capacity"] for row in course_rows}
+    enrollment_rows = []
+    for student in range(1, students + 1):
+        for course in rng.sample(range(1, courses + 1), min(per_student, courses)):
+            if seats[course]:
+                seats[course] -= 1
+                enrollment_rows.append({"student_id": student, "course_id": course,
+                                        "grade": float(rng.randint(40, 100))})
+
+    for model, rows in ((app_module.Term, term_rows), (app_module.Teacher, teacher_rows), (app_module.User, student_rows),
+                        (app_module.Course, course_rows), (app_module.Enrollment, enrollment_rows)):
+        for chunk in app_module.chunked(rows, app_module.IMPORT_CHUNK):
+            db.session.execute(model.__table__.insert(), chunk)
+    app_module.refresh_grade_stats(db.session.connection())
+    app_module.recount_seats() # commits
+    app_module.forget_active_term() # the rows went in without the ORM
+    # and whatever a previous database left in the process caches is stale now
+    app_module.fragment_cache = app_module.make_fragment_cache(app_module.app.config)
+    app_module._identity_cache.clear()
+    app_module.admin_counts.clear()
+    return {"students": students, "teachers": teachers, "courses": courses, "enrollments": len(enrollment_rows)}
+
+
+# Scenarios: setup(worker_rng) returns per-thread state, step(client, state, rng) makes one request
+# and returns the response. Each thread keeps its own test client, so cookies stay per "browser".
+# start() and finish() run once around the measured threads; finish() returns extra report figures.
+def login(client, email):
+    response = client.post("/login_backend", data={"email": email, "password": BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f"login as {email} failed with {response.status_code}")
+
+
+class Scenario:
+    def __init__(self, app_module, scale, options):
+        self.app_module, self.scale, self.options = app_module, scale, options
+
+    def setup(self, client, rng):
+        return None
+
+    def start(self):
+        pass
+
+    def finish(self):
+        return {}
+
+
+class LoginStorm(Scenario):
+    name = "login_storm"
+
+    def step(self, client, state, rng):
+        client = self.app_module.app.test_client() # a new browser each time, so every request really logs in
+        return client.post("/login_backend", data={"email": f"s{rng.randint(1, self.scale['students'])}@bench.edu",
+                                                   "password": BENCH_PASSWORD})
+
+
+class RegistrationRush(Scenario):
+    name = "registration_rush"
+
+    def setup(self, client, rng):
+        login(client, f"s{rng.randint(1, self.scale['students'])}@bench.edu")
+
+    def step(self, client, state, rng):
+        course_id = rng.randint(1, self.scale["courses"])
+        if rng.random() < 0.25:
+            return client.post(f"/drop_course/{course_id}")
+        return client.post(f"/add_course/{course_id}")
+
+
+class GradeSave(Scenario):
+    name = "grade_save"
+
+    def setup(self, client, rng):
+        app_module = self.app_module
+        db, Course, Enrollment = app_module.db, app_module.Course, app_module.Enrollment
+        rosters = {}
+        with app_module.app.app_context(): # worker threads have no app context of their own
+            while not rosters:
+                teacher_id = rng.randint(1, self.scale["teachers"])
+                for course_id, student_id in db.session.execute(
+                    db.select(Enrollment.course_id, Enrollment.student_id)
+                    .join(Course, Course.id == Enrollment.course_id).where(Course.teacher_id == teacher_id)
+                ):
+                    rosters.setdefault(course_id, []).append(student_id)
+        login(client, f"t{teacher_id}@EDUteacher.org")
+        return rosters
+
+    def step(self, client, rosters, rng):
+        course_id = rng.choice(list(rosters))
+        return client.post(f"/api/courses/{course_id}/grades",
+                           json=[{"student_id": student_id, "grade": rng.randint(0, 100)} for student_id in rosters[course_id]])
+
+
+class CatalogBrowse(Scenario):
+    name = "catalog_browse"
+
+    def setup(self, client, rng):
+        student_id = rng.randint(1, self.scale["students"])
+        login(client, f"s{student_id}@bench.edu")
+        return {"student_id": student_id, "cursor": None}
+
+    def step(self, client, state, rng):
+        roll = rng.random()
+        if roll < 0.4:
+            return client.get(f"/all_courses/{state['student_id']}")
+        if roll < 0.6:
+            return client.get(f"/student_view/{state['student_id']}")
+        response = client.get("/api/courses", query_string={"cursor": state["cursor"]} if state["cursor"] else {})
+        state["cursor"] = response.get_json().get("next_cursor") if response.status_code == 200 else None
+        return response
+
+
+class Dashboards(Scenario):
+    name = "dashboards"
+
+    def setup(self, client, rng):
+        student_client = self.app_module.app.test_client()
+        student_id = rng.randint(1, self.scale["students"])
+        login(student_client, f"s{student_id}@bench.edu")
+        teacher_id = rng.randint(1, self.scale["teachers"])
+        login(client, f"t{teacher_id}@EDUteacher.org")
+        return {"student": (student_client, student_id), "teacher_id": teacher_id}
+
+    def step(self, client, state, rng):
+        if rng.random() < 0.5:
+            student_client, student_id = state["student"]
+            return student_client.get(f"/student_view/{student_id}")
+        return client.get(f"/teacher/{state['teacher_id']}")
+
+
+def rss_kb():
+    # resident set size from /proc, None where there is none
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        return None
+
+
+class SeatStreams(RegistrationRush):
+    # --streams open /seats/stream responses, each read by its own thread like the threaded server
+    # would, while the measured threads add and drop courses and so publish seat changes to all of them
+    name = "seat_streams"
+
+    def start(self):
+        broker = self.app_module.seat_broker
+        login_client = self.app_module.app.test_client()
+        login(login_client, "s1@bench.edu")
+        cookie = login_client.get_cookie("session")
+        self.stop, self.events, self.lock = threading.Event(), 0, threading.Lock()
+        opened = threading.Barrier(self.options.streams + 1)
+
+        def hold():
+            client = self.app_module.app.test_client()
+            client.set_cookie(cookie.key, cookie.value)
+            response = client.get("/seats/stream", buffered=False)
+            opened.wait()
+            if response.status_code != 200:
+                return
+            events = 0
+            for chunk in response.response:
+                events += chunk.startswith(b"data:")
+                if self.stop.is_set():
+                    break
+            response.close() # ends the generator, which unsubscribes
+            with self.lock:
+                self.events += events
+
+        tracemalloc.start()
+        heap, rss = tracemalloc.get_traced_memory()[0], rss_kb()
+        self.readers = [threading.Thread(target=hold) for _ in range(self.options.streams)]
+        for reader in self.readers:
+            reader.start()
+        opened.wait()
+        self.subscribers = broker.subscribers
+        self.heap_kb = (tracemalloc.get_traced_memory()[0] - heap) / 1024
+        self.rss_kb = rss_kb() - rss if rss is not None else None
+        tracemalloc.stop()
+
+    def finish(self):
+        broker = self.app_module.seat_broker
+        self.stop.set()
+        broker.publish({}) # wakes every stream waiting for a change
+        for reader in self.readers:
+            reader.join()
+        streams = max(self.subscribers, 1)
+        return {
+            "streams": self.options.streams,
+            "subscribers": self.subscribers,
+            "subscribers_after": broker.subscribers,
+            "events_delivered": self.events,
+            "heap_kb_per_stream": round(self.heap_kb / streams, 2),
+            "rss_kb_per_stream": round(self.rss_kb / streams, 2) if self.rss_kb is not None else None,
+        }
+
+
+SCENARIOS = {scenario.name: scenario for scenario in
+             (LoginStorm, RegistrationRush, GradeSave, CatalogBrowse, Dashboards, SeatStreams)}
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_scenario(app_module, scenario, threads, requests, warmup, seed):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    counter = threading.local()
+    def count_statement(*args):
+        counter.statements = getattr(counter, "statements", 0) + 1
+    event.listen(Engine, "before_cursor_execute", count_statement)
+
+    latencies, statements, errors = [], [], []
+    lock = threading.Lock()
+    per_thread = max(1, requests // threads)
+
+    def worker(number):
+        rng = random.Random(f"{seed}:{scenario.name}:{number}")
+        client = app_module.app.test_client()
+        state = scenario.setup(client, rng)
+        for index in range(warmup + per_thread):
+            counter.statements = 0
+            started = time.perf_counter()
+            response = scenario.step(client, state, rng)
+            elapsed = time.perf_counter() - started
+            if index < warmup:
+                continue
+            with lock:
+                latencies.append(elapsed)
+                statements.append(counter.statements)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+    scenario.start()
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    wall = time.perf_counter() - started
+    extra = scenario.finish()
+    event.remove(Engine, "before_cursor_execute", count_statement)
+
+    latencies.sort()
+    return extra | {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "throughput": round(len(latencies) / wall, 2) if wall else 0.0,
+        "queries_per_request": round(statistics.fmean(statements), 2) if statements else 0.0,
+    }
+
+
+# A scenario regressed when p95 grew or throughput fell by more than the tolerance, or when it
+# issues more SQL per request than before (that one is deterministic, so only a small slack).
+# Failed requests (status >= 400) beyond the baseline's, or any at all without one, are regressions too:
+# their latencies time error pages. Seat streams that stay subscribed after closing are a leak, baseline or not.
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if result.get("subscribers_after"):
+            regressions.append(f"{name}: {result['subscribers_after']} seat streams still subscribed after closing")
+        before = baseline.get("results", {}).get(name)
+        allowed = before.get("errors", 0) if before else 0
+        if result["errors"] > allowed:
+            regressions.append(f"{name}: {result['errors']} failed requests (baseline {allowed})")
+        if before is None:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+        if result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput']} -> {result['throughput']} req/s")
+        if result["queries_per_request"] > before["queries_per_request"] + 0.5:
+            regressions.append(f"{name}: queries/request {before['queries_per_request']} -> {result['queries_per_request']}")
+    return regressions
+
+
+def print_result(key, result):
+    print(f"{key:18} {result['requests']:6} req {result['errors']:4} err  p50 {result['p50_ms']:8.2f}  "
+          f"p95 {result['p95_ms']:8.2f}  p99 {result['p99_ms']:8.2f} ms  {result['throughput']:8.1f} req/s  "
+          f"{result['queries_per_request']:6.2f} queries/req")
+    if "streams" in result:
+        print(f"{'':18} {result['subscribers']} of {result['streams']} streams subscribed, "
+              f"{result['subscribers_after']} left after closing, {result['events_delivered']} events delivered, "
+              f"{result['heap_kb_per_stream']} kB heap and {result['rss_kb_per_stream']} kB RSS per stream")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the registration app.")
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--user-sizes", type=lambda text: [int(size) for size in text.split(",")],
+                        help="Comma separated student counts; regenerates and reruns the scenarios "
+                             "(default login_storm and dashboards) at each, e.g. 1000,10000,100000.")
+    parser.add_argument("--teachers", type=int, default=50)
+    parser.add_argument("--courses", type=int, default=200)
+    parser.add_argument("--per-student", type=int, default=4, help="Enrollments per student.")
+    parser.add_argument("--capacity", type=int, help="Seats in every course (default: a mix of 20 to 150).")
+    parser.add_argument("--seed", type=int, default=106)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Repeat to run several, default all.")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario.")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests per thread first.")
+    parser.add_argument("--streams", type=int, default=200, help="Seat streams held open by seat_streams.")
+    parser.add_argument("--db", help="SQLite file to generate into (default: a temporary file).")
+    parser.add_argument("--baseline", help="Compare with this baseline JSON.")
+    parser.add_argument("--save-baseline", help="Write the results here as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95/throughput drift, 0.25 = 25%%.")
+    args = parser.parse_args(argv)
+
+    scratch = None
+    if args.db:
+        path = os.path.abspath(args.db)
+    else:
+        scratch = tempfile.TemporaryDirectory()
+        path = os.path.join(scratch.name, "bench.sqlite")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}" # read by app.py at import time
+    import app as app_module
+
+    if not os.path.isdir(os.path.join(os.path.dirname(app_module.__file__), "templates")):
+        app_module.app.template_folder = os.path.dirname(os.path.abspath(app_module.__file__)) # pages next to app.py
+
+    # one database per --user-sizes entry, results keyed "<scenario>@<students>" so baselines still line up
+    sizes = args.user_sizes or [args.students]
+    names = args.scenario or (["login_storm", "dashboards"] if args.user_sizes else list(SCENARIOS))
+    results, scales = {}, []
+    for students in sizes:
+        print(f"generating database (seed {args.seed}) ...", file=sys.stderr)
+        with app_module.app.app_context():
+            scale = generate(app_module, students, args.teachers, args.courses, args.per_student, args.seed, args.capacity)
+        print(f"  {scale}", file=sys.stderr)
+        scales.append(scale)
+        for name in names:
+            key = f"{name}@{students}" if args.user_sizes else name
+            scenario = SCENARIOS[name](app_module, scale, args)
+            results[key] = run_scenario(app_module, scenario, args.threads, args.requests, args.warmup, args.seed)
+            print_result(key, results[key])
+
+    if args.user_sizes:
+        print(f"\n{'p50 / p95 ms':18}" + "".join(f"{students:>20,}" for students in sizes) + "  students")
+        for name in names:
+            print(f"{name:18}" + "".join(f"{results[f'{name}@{students}']['p50_ms']:10.2f}"
+                                         f"{results[f'{name}@{students}']['p95_ms']:10.2f}" for students in sizes))
+
+    report = {"scale": scales if args.user_sizes else scale, "seed": args.seed, "threads": args.threads,
+              "db_profile": app_module.app.config["DB_PROFILE"], "results": results}
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    status = 1 if regressions else 0
+    if args.save_baseline:
+        if any(result["errors"] for result in results.values()):
+            print(f"not saving {args.save_baseline}: requests failed, a baseline would time error pages", file=sys.stderr)
+        else:
+            with open(args.save_baseline, "w") as file:
+                json.dump(report, file, indent=2)
+    with app_module.app.app_context():
+        app_module.db.engine.dispose()
+    if scratch is not None:
+        scratch.cleanup()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
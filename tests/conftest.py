@@ -0,0 +1,127 @@
+# The app reads its settings from the environment when it is imported, so point it at a scratch
+# SQLite file (and cheap, in-process password hashing) before anything imports it. Whatever APP_*
+# settings the shell has are dropped and the caches pinned: the tests count SQL statements, and an
+# identity cache, a different admin count TTL or a replica would change those counts.
+import os
+import sys
+import tempfile
+import threading
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH = tempfile.mkdtemp(prefix="registration-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(SCRATCH, 'test.sqlite')}"
+for name in [name for name in os.environ if name.startswith("APP_")]:
+    del os.environ[name]
+os.environ.update({
+    "APP_PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+    "APP_PASSWORD_HASH_WORKERS": "0",
+    "APP_DB_PROFILE": "default",        # production would add a read-only replica connection
+    "APP_IDENTITY_CACHE_TTL": "0",      # every request loads its user: one statement
+    "APP_ADMIN_COUNT_CACHE_TTL": "60",  # an unfiltered admin list counts once, then reuses it
+    "APP_TERM_CACHE_TTL": "60",
+    "APP_FRAGMENT_CACHE_TTL": "300",
+    "APP_FRAGMENT_CACHE_SIZE": "1024",
+})
+sys.path.insert(0, ROOT)
+
+import app as app_module # noqa: E402
+
+if not os.path.isdir(os.path.join(ROOT, "templates")):
+    app_module.app.template_folder = ROOT # the pages sit next to app.py in this checkout
+
+PASSWORD = "test-password"
+
+
+@pytest.fixture
+def app():
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+    app_module.fragment_cache.entries.clear()
+    app_module.admin_counts.clear()
+    app_module.forget_active_term()
+    yield app_module.app
+    with app_module.app.app_context():
+        app_module.db.session.remove()
+
+
+@pytest.fixture
+def db(app):
+    with app.app_context():
+        yield app_module.db
+
+
+@pytest.fixture
+def add_rows(app):
+    # add_rows(Model, [dict, ...]) -> ids, in their own app context so threads can use them too
+    hashed = app_module.hash_password(PASSWORD)
+
+    def add(model, rows):
+        with app.app_context():
+            objects = [model(**({"password": hashed} if hasattr(model, "password") else {}) | row) for row in rows]
+            app_module.db.session.add_all(objects)
+            app_module.db.session.commit()
+            return [obj.id for obj in objects]
+    return add
+
+
+@pytest.fixture
+def school(add_rows):
+    # school(...) seeds an active term, teachers t<n>@EDUteacher.org, courses "CSE 1<nn>" dealt round-robin
+    # to them and students s<n>@x, who each take the first `takes` courses (only the first `enrolled`
+    # students, when given), graded if `grades`. `capacity` and `time` are one value or a list, one per course.
+    def seed(courses=1, students=1, teachers=1, takes=0, enrolled=None, capacity=50, time="TBA", grades=False):
+        term_id, = add_rows(app_module.Term, [{"name": "Fall", "active": True}])
+        teacher_ids = add_rows(app_module.Teacher, [{"teacherName": f"T{n}", "email": f"t{n}@EDUteacher.org"}
+                                                    for n in range(teachers)])
+        capacities = capacity if isinstance(capacity, list) else [capacity] * courses
+        times = time if isinstance(time, list) else [time] * courses
+        course_ids = add_rows(app_module.Course, [{"courseName": f"CSE {100 + n}", "time": times[n], "capacity": capacities[n],
+                                                   "teacher_id": teacher_ids[n % teachers]} for n in range(courses)])
+        student_ids = add_rows(app_module.User, [{"studentName": f"S{n}", "email": f"s{n}@x"} for n in range(students)])
+        add_rows(app_module.Enrollment, [
+            {"student_id": student_id, "course_id": course_id} | ({"grade": (7 * student_id + course_id) % 100} if grades else {})
+            for student_id in student_ids[:enrolled] for course_id in course_ids[:takes]])
+        return SimpleNamespace(term_id=term_id, teacher_ids=teacher_ids, course_ids=course_ids, student_ids=student_ids)
+    return seed
+
+
+def login(client, email, password=PASSWORD):
+    response = client.post("/login_backend", data={"email": email, "password": password})
+    assert response.status_code == 302, response.data
+    return client
+
+
+@pytest.fixture
+def statements():
+    # SQL statements run on this thread, cleared by the test before the request it measures
+    seen = []
+    thread = threading.get_ident()
+
+    def count(connection, cursor, statement, *args):
+        if threading.get_ident() == thread:
+            seen.append(statement)
+    event.listen(Engine, "before_cursor_execute", count)
+    yield seen
+    event.remove(Engine, "before_cursor_execute", count)
+
+
+def run_parallel(calls):
+    # start every call at the same moment, one thread each, and return their results in order
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def run(index, call):
+        barrier.wait()
+        results[index] = call()
+    threads = [threading.Thread(target=run, args=(index, call)) for index, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
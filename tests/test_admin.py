@@ -0,0 +1,47 @@
+import pytest
+
+from conftest import app_module, login
+
+
+@pytest.fixture
+def admin_client(app, add_rows):
+    add_rows(app_module.AdminLogin, [{"email": "a@admin"}])
+    return lambda: login(app.test_client(), "a@admin")
+
+
+@pytest.mark.parametrize("size", [5, 40])
+@pytest.mark.parametrize("path", ["/admin/course/", "/admin/enrollment/", "/admin/user/"])
+def test_admin_list_statements_do_not_grow(school, admin_client, statements, size, path):
+    school(courses=size, students=size, teachers=size, takes=3, capacity=500)
+    client = admin_client()
+
+    statements.clear()
+    assert client.get(path).status_code == 200
+    # the admin, the row count, the page with its related rows joined in
+    assert len(statements) == 3
+
+    statements.clear()
+    assert client.get(path).status_code == 200
+    assert len(statements) == 2 # the count comes from admin_counts
+
+
+def test_admin_search_is_counted_every_time(school, admin_client, statements):
+    school(courses=40, students=40, teachers=40, takes=3, capacity=500)
+    client = admin_client()
+
+    for _ in range(2):
+        statements.clear()
+        response = client.get("/admin/course/?search=cse 11")
+        assert response.status_code == 200
+        assert len(statements) == 3
+        assert response.data.decode().count("CSE 11") == 10
+
+
+def test_deleting_one_row_flashes_once(app, db, school, admin_client):
+    teacher_id, = school(courses=2).teacher_ids
+    client = admin_client()
+    response = client.post("/admin/teacher/delete/", data={"id": teacher_id, "url": "/admin/teacher/"})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert [message for _, message in session["_flashes"]] == ["Record was successfully deleted."]
+    assert db.session.get(app_module.Teacher, teacher_id) is None
@@ -0,0 +1,65 @@
+import pytest
+
+from conftest import app_module
+
+
+class DictClient:
+    # the handful of redis commands SharedCache uses, on a dict
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode() if isinstance(value, str) else value
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+        return int(self.data[key])
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+@pytest.fixture(params=["lru", "shared"])
+def cache(request):
+    if request.param == "lru":
+        return app_module.LRUCache(max_entries=10, ttl=60)
+    return app_module.SharedCache(DictClient(), ttl=60)
+
+
+def test_fills_and_invalidates(cache):
+    cache.set("catalog:1", ["rows"], cache.version("catalog:1"))
+    assert cache.get("catalog:1") == ["rows"]
+    cache.delete({"catalog:1"})
+    assert cache.get("catalog:1") is None
+
+
+def test_a_render_started_before_an_invalidation_is_not_stored(cache):
+    version = cache.version("catalog:1") # render starts
+    cache.delete({"catalog:1"})           # a commit invalidates meanwhile
+    cache.set("catalog:1", ["stale"], version)
+    assert cache.get("catalog:1") is None
+
+
+def test_a_stale_write_racing_past_the_version_check_is_not_served():
+    # another process invalidates between set()'s version check and its SET: the value lands, but under
+    # the old version, so it is never served
+    client = DictClient()
+    cache = app_module.SharedCache(client, ttl=60)
+    version = cache.version("catalog:1")
+    store = client.set
+
+    def invalidate_then_store(key, value, ex=None):
+        client.incr("fragment:version:catalog:1")
+        store(key, value, ex)
+    client.set = invalidate_then_store
+    cache.set("catalog:1", ["stale"], version)
+
+    assert client.get("fragment:catalog:1") is not None
+    assert cache.get("catalog:1") is None
@@ -0,0 +1,37 @@
+import pytest
+
+from conftest import login
+
+
+@pytest.mark.parametrize("courses", [5, 60])
+def test_catalog_statements_do_not_grow_with_courses(app, school, statements, courses):
+    student_id = school(courses=courses, students=3, teachers=3, takes=5).student_ids[0]
+    client = login(app.test_client(), "s0@x")
+
+    statements.clear()
+    response = client.get(f"/all_courses/{student_id}")
+    assert response.status_code == 200
+    assert response.data.decode().count("CSE 1") == courses
+    # the student, the catalog rows, the conflict marks
+    assert len(statements) == 3
+
+    statements.clear()
+    client.get(f"/all_courses/{student_id}")
+    assert len(statements) == 2 # catalog rows come from the fragment cache
+
+
+@pytest.mark.parametrize("flag, names", [("1", ["CSE 101"]), ("true", ["CSE 101"]),
+                                         ("0", ["CSE 100", "CSE 101"]), ("false", ["CSE 100", "CSE 101"]),
+                                         ("", ["CSE 100", "CSE 101"])])
+def test_catalog_api_open_filter(app, school, flag, names):
+    school(courses=2, capacity=[0, 5])
+    client = login(app.test_client(), "s0@x")
+
+    response = client.get("/api/courses", query_string={"open": flag})
+    assert [course["courseName"] for course in response.get_json()["courses"]] == names
+
+
+def test_catalog_api_rejects_bad_open_flag(app, school):
+    school()
+    client = login(app.test_client(), "s0@x")
+    assert client.get("/api/courses?open=maybe").status_code == 400
@@ -0,0 +1,39 @@
+import pytest
+
+from conftest import app_module, login
+
+
+@pytest.mark.parametrize("courses, students", [(1, 2), (8, 40)])
+def test_student_view_statements_do_not_grow(app, school, statements, courses, students):
+    student_ids = school(courses=courses, students=students, takes=courses, capacity=500, grades=True).student_ids
+    client = login(app.test_client(), "s0@x")
+
+    statements.clear()
+    response = client.get(f"/student_view/{student_ids[0]}")
+    assert response.status_code == 200
+    assert response.data.decode().count("CSE 1") == courses
+    # the student, their courses with teacher and seat counts
+    assert len(statements) == 2
+
+
+@pytest.mark.parametrize("courses, students", [(1, 2), (8, 40)])
+def test_teacher_view_statements_do_not_grow(app, school, statements, courses, students):
+    teacher_id, = school(courses=courses, students=students, takes=courses, capacity=500, grades=True).teacher_ids
+    client = login(app.test_client(), "t0@EDUteacher.org")
+
+    statements.clear()
+    response = client.get(f"/teacher/{teacher_id}")
+    assert response.status_code == 200
+    assert response.data.decode().count("CSE 1") == 2 * courses # course rows and grade statistics
+    # the teacher, their course rows, the grade summaries, the histogram buckets
+    assert len(statements) == 4
+
+    statements.clear()
+    assert client.get(f"/teacher/{teacher_id}").status_code == 200
+    assert len(statements) == 3 # course rows from the fragment cache
+
+
+def test_student_courses_is_driven_from_the_students_enrollments(app, db):
+    plan = app_module.query_plan(db.session.connection(), app_module.student_courses_query(1, 1))
+    assert plan[0].startswith("SEARCH enrollment USING")
+    assert not [step for step in plan if step.startswith("SCAN")]
@@ -0,0 +1,45 @@
+from conftest import app_module, login, run_parallel
+
+Course, Enrollment, Term = app_module.Course, app_module.Enrollment, app_module.Term
+query_plan = app_module.query_plan
+
+
+def test_parallel_add_course_never_overbooks(app, db, school):
+    seeded = school(students=30, capacity=5, time="MWF 9:00-9:50 AM")
+    course_id, student_ids = seeded.course_ids[0], seeded.student_ids
+    clients = [login(app.test_client(), f"s{n}@x") for n in range(len(student_ids))]
+
+    responses = run_parallel([lambda client=client: client.post(f"/add_course/{course_id}") for client in clients])
+
+    assert all(response.status_code == 302 for response in responses)
+    db.session.expire_all()
+    assert db.session.get(Course, course_id).enrolled_count == 5
+    assert Enrollment.query.filter_by(course_id=course_id).count() == 5
+
+
+def test_schedule_conflicts(app, db, add_rows, school):
+    # the student takes MWF 9:00; the catalog has a clash, a free slot and the same slot in another term
+    seeded = school(courses=4, takes=1, time=["MWF 9:00-9:50 AM", "MW 9:30-10:20 AM", "TR 9:00-9:50 AM", "MWF 9:00-9:50 AM"])
+    student_id, = seeded.student_ids
+    taken, clash, free, other_term = seeded.course_ids
+    spring, = add_rows(Term, [{"name": "Spring"}])
+    db.session.execute(db.update(Course).where(Course.id == other_term).values(term_id=spring))
+    db.session.commit()
+
+    assert app_module.schedule_conflict(student_id, clash).id == taken
+    assert app_module.schedule_conflict(student_id, free) is None
+    assert app_module.schedule_conflict(student_id, other_term) is None
+    assert app_module.conflicting_courses(student_id) == {clash}
+
+    client = login(app.test_client(), "s0@x")
+    response = client.post("/checkout", json={"course_ids": [clash, free, other_term], "mode": "best_effort"})
+    assert {row["course_id"]: row["status"] for row in response.get_json()["results"]} == \
+        {clash: "conflict", free: "enrolled", other_term: "enrolled"}
+
+
+def test_schedule_conflict_queries_start_from_enrollment(app, db):
+    connection = db.session.connection()
+    for query in (app_module.schedule_conflict_query(1, 1), app_module.conflicting_courses_query(1)):
+        plan = query_plan(connection, query)
+        assert [step for step in plan if "enrollment" in step or "ix_course_meeting" in step][0] \
+            .startswith("SEARCH enrollment")
@@ -0,0 +1,26 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from conftest import app_module, login
+
+
+def test_failed_statements_do_not_leak_start_times(app, db):
+    with db.engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM no_such_table"))
+        assert connection.info.get("query_started") == []
+        connection.execute(text("SELECT 1"))
+        assert connection.info["query_started"] == []
+
+
+def test_metrics_are_for_admins_unless_made_public(app, add_rows, school, monkeypatch):
+    school()
+    add_rows(app_module.AdminLogin, [{"email": "a@admin"}])
+    assert app.test_client().get("/metrics").status_code == 302
+    assert login(app.test_client(), "s0@x").get("/metrics").status_code == 403
+    response = login(app.test_client(), "a@admin").get("/metrics")
+    assert response.status_code == 200 and b"app_fragment_cache_hits_total" in response.data
+    monkeypatch.setitem(app.config, "METRICS_PUBLIC", True)
+    assert app.test_client().get("/metrics").status_code == 200
@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Integer, MetaData, Table
+
+from conftest import app_module
+
+
+def test_ensure_unique_keeps_the_oldest_row_and_leaves_metadata_alone(app, db):
+    pairs = Table("pairs", MetaData(), Column("id", Integer, primary_key=True), Column("a", Integer), Column("b", Integer))
+    with db.engine.begin() as connection:
+        pairs.create(connection)
+        connection.execute(pairs.insert(), [{"a": 1, "b": 1}, {"a": 1, "b": 1}, {"a": 1, "b": 2}])
+        app_module.ensure_unique(connection, pairs, ("a", "b"), "unique_pairs")
+        assert connection.execute(db.select(pairs.c.id).order_by(pairs.c.id)).scalars().all() == [1, 3]
+        indexes = db.inspect(connection).get_indexes("pairs")
+        assert [(index["name"], index["unique"]) for index in indexes] == [("unique_pairs", 1)]
+        assert not pairs.indexes
+        pairs.drop(connection)
+
+
+def test_hot_query_plans_are_clean(app, db):
+    connection = db.session.connection()
+    for name, query in app_module.hot_queries().items():
+        assert app_module.plan_problems(app_module.query_plan(connection, query)) == [], name
+
+
+def test_plan_problems_flags_a_catalog_walk_before_enrollment(app, db):
+    # schedule_conflict as it was: course-first over ix_course_meeting, enrollment probed per course
+    Course, Enrollment = app_module.Course, app_module.Enrollment
+    new = db.aliased(Course)
+    course_first = (
+        db.select(Course.id).join(Enrollment, Enrollment.course_id == Course.id).join(new, new.id == 1)
+        .where(Enrollment.student_id == 1, Course.id != 1, app_module.meetings_overlap(Course, new)).limit(1)
+    )
+    plan = app_module.query_plan(db.session.connection(), course_first)
+    assert [step for step in app_module.plan_problems(plan) if "ix_course_meeting" in step]
@@ -0,0 +1,78 @@
+# Read/write routing against two real SQLite files: the replica starts as a copy of the primary, then
+# its course names are changed, so every response shows which database served it.
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+from conftest import SCRATCH, app_module, login
+
+Course, Enrollment, User = app_module.Course, app_module.Enrollment, app_module.User
+
+
+@pytest.fixture
+def replica(app, db, school, monkeypatch):
+    school(courses=3, capacity=5)
+
+    path = os.path.join(SCRATCH, "replica.sqlite")
+    if os.path.exists(path):
+        os.remove(path)
+    source, target = sqlite3.connect(db.engine.url.database), sqlite3.connect(path)
+    source.backup(target)
+    target.execute("UPDATE course SET courseName = 'REPLICA ' || id")
+    target.commit()
+    source.close()
+    target.close()
+
+    engine = create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+    monkeypatch.setattr(app_module, "replica_engine", engine)
+    yield engine
+    engine.dispose()
+
+
+def course_names(client):
+    response = client.get("/api/courses")
+    assert response.status_code == 200
+    return {course["courseName"].split()[0] for course in response.get_json()["courses"]}
+
+
+def read_from_replica(client):
+    with client.session_transaction() as session:
+        session["primary_until"] = 0 # past the sticky window of the login
+
+
+def test_read_only_views_read_the_replica(app, replica):
+    client = login(app.test_client(), "s0@x")
+    read_from_replica(client)
+
+    assert course_names(client) == {"REPLICA"}
+    assert course_names(client) == {"REPLICA"} # reads alone do not stick to the primary
+
+
+def test_writes_go_to_the_primary_and_stick(app, db, replica):
+    client = login(app.test_client(), "s0@x")
+    read_from_replica(client)
+    course_id = db.session.execute(db.select(Course.id).limit(1)).scalar()
+
+    assert client.post(f"/add_course/{course_id}").status_code == 302
+
+    assert Enrollment.query.filter_by(course_id=course_id).count() == 1
+    with replica.connect() as connection:
+        assert connection.exec_driver_sql("SELECT count(*) FROM enrollment").scalar() == 0
+    assert course_names(client) == {"CSE"} # its own write is visible right away
+
+    read_from_replica(client)
+    assert course_names(client) == {"REPLICA"}
+
+
+def test_fragment_cache_fills_from_the_primary(app, db, replica):
+    # a lagging replica must not put pre-commit rows back into the shared fragment cache
+    client = login(app.test_client(), "s0@x")
+    read_from_replica(client)
+    student_id = db.session.execute(db.select(User.id)).scalar()
+
+    page = client.get(f"/all_courses/{student_id}").data.decode()
+
+    assert "CSE 100" in page and "REPLICA" not in page
+    assert course_names(client) == {"REPLICA"} # the rest of the view still reads the replica
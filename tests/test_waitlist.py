@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from conftest import app_module, login, run_parallel
+
+Course, Enrollment, Waitlist = app_module.Course, app_module.Enrollment, app_module.Waitlist
+
+
+@pytest.mark.parametrize("round", range(5))
+def test_simultaneous_drops_never_promote_the_same_student_twice(app, db, add_rows, school, round):
+    seeded = school(students=5, takes=1, enrolled=2, capacity=2, time="MWF 9:00-9:50 AM")
+    course_id, student_ids = seeded.course_ids[0], seeded.student_ids
+    add_rows(Waitlist, [{"course_id": course_id, "student_id": student_id, "position": position}
+                        for position, student_id in enumerate(student_ids[2:], start=1)])
+    clients = [login(app.test_client(), f"s{n}@x") for n in range(2)]
+
+    responses = run_parallel([lambda client=client: client.post(f"/drop_course/{course_id}") for client in clients])
+
+    assert all(response.status_code == 302 for response in responses)
+    db.session.expire_all()
+    enrolled = Enrollment.query.filter_by(course_id=course_id).all()
+    assert sorted(enrollment.student_id for enrollment in enrolled) == student_ids[2:4]
+    assert db.session.get(Course, course_id).enrolled_count == 2
+    assert [row.student_id for row in Waitlist.query.filter_by(course_id=course_id)] == student_ids[4:]
+
+
+def test_parallel_joins_get_distinct_places(app, db, school):
+    seeded = school(students=10, capacity=0)
+    course_id, student_ids = seeded.course_ids[0], seeded.student_ids
+    clients = [login(app.test_client(), f"s{n}@x") for n in range(len(student_ids))]
+
+    responses = run_parallel([lambda client=client: client.post(f"/join_waitlist/{course_id}") for client in clients])
+
+    assert all(response.status_code == 302 for response in responses)
+    positions = [row.position for row in Waitlist.query.filter_by(course_id=course_id)]
+    assert sorted(positions) == list(range(1, len(student_ids) + 1))
+
+
+def test_join_waitlist_rejected_while_seats_are_open(app, db, school):
+    course_id, = school(capacity=3).course_ids
+    client = login(app.test_client(), "s0@x")
+
+    response = client.post(f"/join_waitlist/{course_id}", follow_redirects=True)
+
+    assert b"still has open seats" in response.data
+    assert Waitlist.query.count() == 0
+
+
+def test_join_waitlist_raises_for_a_missing_course(app, db, school):
+    student_id, = school(courses=0).student_ids
+    with pytest.raises(IntegrityError):
+        app_module.join_waitlist(student_id, 999)